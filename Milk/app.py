@@ -1,28 +1,114 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
+import json
 import os
-from datetime import datetime
-import sys
-import torch
-from pathlib import Path
-
-# Add the stable-diffusion-project to Python path
-sys.path.append(str(Path(__file__).parent.parent / 'stable-diffusion-project'))
-from src.generate import get_pipeline
-from src.advanced_generation import generate_img2img, generate_inpaint
-from src.config.config_manager import ConfigManager
-from src.config.model_config import ModelConfig, DEFAULT_CONFIGS
+import time
+
+# Inference runs in this process, or in model server processes shared by all web workers
+# when MILK_MODEL_SERVER lists their sockets (see model_server.py)
+MODEL_SERVER = os.environ.get('MILK_MODEL_SERVER')
+if MODEL_SERVER:
+    from model_server import ModelServerClient
+    service = ModelServerClient(MODEL_SERVER.split(','))
+else:
+    import service
+from jobs import QueueFullError
+# Both imports above put the stable-diffusion-project sources on the path
+from image_input import InputImageError, prepare_image, read_limited
+from config.model_config import DEFAULT_CONFIGS, model_size
+
+generate_image = service.generate_image
+transform_image = service.transform_image
 
 app = Flask(__name__)
 
-# Initialize configuration
-config_manager = ConfigManager()
-config = config_manager.load_config()
+# Number of trusted proxies in front of Milk; each rewrites the remote address from the
+# X-Forwarded-For entry its hop appended, so clients cannot set their own address
+PROXY_HOPS = int(os.environ.get('MILK_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# Uploads are read into memory up to this size, and decoded only when their header is within
+# the pixel limit; others are refused with 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MILK_MAX_UPLOAD_MB', 20)) * 1024 * 1024
+MAX_UPLOAD_PIXELS = int(os.environ.get('MILK_MAX_UPLOAD_PIXELS', 50_000_000))
+
+# Generations are scheduled fairly between clients, identified by this header or else by remote address
+CLIENT_HEADER = os.environ.get('MILK_CLIENT_HEADER', 'X-Client-Id')
+
+# How often job event streams check for progress, in seconds
+SSE_POLL_INTERVAL = float(os.environ.get('MILK_SSE_POLL_INTERVAL', 0.25))
+
+def parse_generate_params(data):
+    """Read text-to-image parameters from a JSON request body."""
+    return {
+        'prompt': data.get('prompt'),
+        'negative_prompt': data.get('negative_prompt', ''),
+        'model': data.get('model', 'sd-v1-5'),
+        'scheduler': data.get('scheduler', 'default'),
+        'steps': int(data.get('steps', 50)),
+        'guidance': float(data.get('guidance', 7.5)),
+        'width': int(data.get('width', 512)),
+        'height': int(data.get('height', 512)),
+        'num_images': int(data.get('num_images', 1)),
+        'seed': int(data.get('seed', -1)),
+        'refiner': data.get('refiner'),
+        'refiner_start': float(data.get('refiner_start', 0.8)),
+    }
+
+def parse_img2img_params(form):
+    """Read image-to-image parameters from a multipart form."""
+    return {
+        'prompt': form.get('prompt'),
+        'negative_prompt': form.get('negative_prompt', ''),
+        'strength': float(form.get('strength', 0.75)),
+        'model': form.get('model', 'sd-v1-5'),
+        'scheduler': form.get('scheduler', 'default'),
+        'steps': int(form.get('steps', 50)),
+        'guidance': float(form.get('guidance', 7.5)),
+        'num_images': int(form.get('num_images', 1)),
+        'seed': int(form.get('seed', -1)),
+    }
+
+def read_upload(form, image_file, model):
+    """Read an uploaded image from the request stream and decode it at the model's native size.
+
+    Decoding here, before the request is queued, refuses oversized uploads with 413
+    up front and keeps only the bounded image, not the upload's bytes, in the job.
+    The original is stored only when the form sets keep_original. Returns the
+    decoded image and the stored original's URL, or None.
+    """
+    data = read_limited(image_file.stream, MAX_UPLOAD_BYTES)
+    size = model_size(model, DEFAULT_CONFIGS['sd-v1-5'])
+    image = prepare_image(data, max_pixels=size['width'] * size['height'],
+                          max_input_pixels=MAX_UPLOAD_PIXELS, max_input_bytes=MAX_UPLOAD_BYTES)
+    upload_url = None
+    if form.get('keep_original') in ('1', 'true', 'on'):
+        upload_url = '/' + service.save_upload(data, image_file.filename)
+    return image, upload_url
+
+def client_id():
+    """Identify the requesting client for per-client scheduling and quotas.
+
+    Without the client header, the remote address is used (the trusted proxy's view
+    of it when MILK_PROXY_HOPS is set). A request with neither is anonymous (''),
+    which is held to the per-client limits like any other client.
+    """
+    return request.headers.get(CLIENT_HEADER) or request.remote_addr or ''
 
-# Ensure upload directories exist
-UPLOAD_FOLDER = 'static/uploads'
-GENERATED_FOLDER = 'static/generated'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(GENERATED_FOLDER, exist_ok=True)
+def queue_full(e):
+    """Response for a request refused because the queue or the client's quota is full."""
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), 429
+
+def image_error(e):
+    """Response for an upload over the byte or pixel limit."""
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), 413
 
 @app.route('/')
 def home():
@@ -31,55 +117,10 @@ def home():
 @app.route('/generate', methods=['POST'])
 def generate():
     try:
-        data = request.json
-        prompt = data.get('prompt')
-        negative_prompt = data.get('negative_prompt', '')
-        model_name = data.get('model', 'sd-v1-5')
-        scheduler = data.get('scheduler', 'default')
-        steps = int(data.get('steps', 50))
-        guidance = float(data.get('guidance', 7.5))
-        width = int(data.get('width', 512))
-        height = int(data.get('height', 512))
-        num_images = int(data.get('num_images', 1))
-        seed = int(data.get('seed', -1))
-
-        # Update config
-        config.model_id = DEFAULT_CONFIGS[model_name].model_id
-        config.scheduler = scheduler
-        config.num_inference_steps = steps
-        config.guidance_scale = guidance
-        config.width = width
-        config.height = height
-        config.num_images = num_images
-        config.seed = seed if seed > 0 else None
-        config.negative_prompt = negative_prompt
-
-        # Generate images
-        pipe = get_pipeline(config)
-        images = pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=steps,
-            guidance_scale=guidance,
-            width=width,
-            height=height,
-            num_images_per_prompt=num_images
-        ).images
-
-        # Save images
-        image_paths = []
-        for i, image in enumerate(images):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_{timestamp}_{i}.png"
-            image_path = os.path.join(GENERATED_FOLDER, filename)
-            image.save(image_path)
-            image_paths.append(f"/static/generated/{filename}")
-
-        return jsonify({
-            'success': True,
-            'images': image_paths
-        })
+        return jsonify(generate_image(client=client_id(), **parse_generate_params(request.json)))
 
+    except QueueFullError as e:
+        return queue_full(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -92,59 +133,144 @@ def img2img():
         if 'image' not in request.files:
             return jsonify({'error': 'No image provided'}), 400
 
-        image_file = request.files['image']
-        prompt = request.form.get('prompt')
-        negative_prompt = request.form.get('negative_prompt', '')
-        strength = float(request.form.get('strength', 0.75))
-        model_name = request.form.get('model', 'sd-v1-5')
-        scheduler = request.form.get('scheduler', 'default')
-        steps = int(request.form.get('steps', 50))
-        guidance = float(request.form.get('guidance', 7.5))
-        num_images = int(request.form.get('num_images', 1))
-        seed = int(request.form.get('seed', -1))
-
-        # Save uploaded image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_path = os.path.join(UPLOAD_FOLDER, f"input_{timestamp}.png")
-        image_file.save(image_path)
-
-        # Update config
-        config.model_id = DEFAULT_CONFIGS[model_name].model_id
-        config.scheduler = scheduler
-        config.num_inference_steps = steps
-        config.guidance_scale = guidance
-        config.num_images = num_images
-        config.seed = seed if seed > 0 else None
-        config.negative_prompt = negative_prompt
-
-        # Generate images
-        from PIL import Image
-        init_image = Image.open(image_path)
-        images = generate_img2img(
-            config=config,
-            init_image=init_image,
-            prompt=prompt,
-            strength=strength
-        )
-
-        # Save generated images
-        image_paths = []
-        for i, image in enumerate(images):
-            filename = f"generated_{timestamp}_{i}.png"
-            output_path = os.path.join(GENERATED_FOLDER, filename)
-            image.save(output_path)
-            image_paths.append(f"/static/generated/{filename}")
+        params = parse_img2img_params(request.form)
+        image, upload_url = read_upload(request.form, request.files['image'], params['model'])
+        result = transform_image(image, client=client_id(), **params)
+        if upload_url:
+            result['upload'] = upload_url
+        return jsonify(result)
 
+    except InputImageError as e:
+        return image_error(e)
+    except QueueFullError as e:
+        return queue_full(e)
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'images': image_paths
-        })
+            'success': False,
+            'error': str(e)
+        }), 500
 
+def submit_job(kind, params, options=None, upload_url=None):
+    """Queue a job and return the accepted response, or 429 when the queue is full."""
+    try:
+        job = service.submit_job(kind, params, options, client=client_id())
+    except QueueFullError as e:
+        return queue_full(e)
+    response = {
+        'success': True,
+        'job_id': job['job_id'],
+        'status_url': f"/jobs/{job['job_id']}",
+        'events_url': f"/jobs/{job['job_id']}/events",
+        'result_url': f"/jobs/{job['job_id']}/result"
+    }
+    if upload_url:
+        response['upload'] = upload_url
+    return jsonify(response), 202
+
+@app.route('/jobs/generate', methods=['POST'])
+def submit_generate():
+    try:
+        options = {'preview': bool(request.json.get('preview'))}
+        return submit_job('generate', parse_generate_params(request.json), options)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
+        }), 400
+
+@app.route('/jobs/img2img', methods=['POST'])
+def submit_img2img():
+    try:
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image provided'}), 400
+
+        params = parse_img2img_params(request.form)
+        image, upload_url = read_upload(request.form, request.files['image'], params['model'])
+        options = {'preview': request.form.get('preview') in ('1', 'true', 'on')}
+        return submit_job('img2img', dict(params, image=image), options, upload_url)
+    except InputImageError as e:
+        return image_error(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = service.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    job.pop('result')
+    return jsonify(dict(job, success=True))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = service.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    result = job.pop('result')
+    if job['status'] == 'failed':
+        return jsonify({'success': False, 'error': job['error']}), 500
+    if job['status'] != 'done':
+        return jsonify(dict(job, success=False)), 202
+    return jsonify(result)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = service.cancel_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(dict(job, success=True))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's progress as Server-Sent Events until it finishes.
+
+    Each poll marks the job as watched. Closing the stream does not cancel the job;
+    the service cancels it once no stream has reconnected within its grace period.
+    """
+    if service.get_job(job_id) is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+
+    def stream():
+        last = None
+        while True:
+            job = service.get_job(job_id, watch=True)
+            if job is None:
+                yield f"event: failed\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+                return
+            result = job.pop('result')
+            if job != last:
+                # Previews are only resent when they change
+                unchanged = last is not None and job['preview'] == last['preview']
+                yield f"event: progress\ndata: {json.dumps(dict(job, preview=None if unchanged else job['preview']))}\n\n"
+                last = job
+            else:
+                # Comment lines keep proxies from closing idle streams
+                yield ":\n\n"
+            if job['status'] in ('done', 'failed', 'cancelled'):
+                payload = result if job['status'] == 'done' else job
+                yield f"event: {job['status']}\ndata: {json.dumps(payload)}\n\n"
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = service.ready()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(service.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(service.metrics(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,247 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class QuotaExceededError(QueueFullError):
+    """Raised when a client's queued and running work would go over its cost budget."""
+
+
+@dataclass(eq=False)
+class Job:
+    kind: str
+    params: Dict[str, Any]
+    options: Dict[str, Any] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"  # queued, running, done, failed, cancelled
+    progress: float = 0.0
+    step: int = 0
+    total_steps: Optional[int] = None
+    preview: Optional[str] = None  # data URL of the latest latent preview
+    cancel_requested: bool = False
+    watched_at: Optional[float] = None  # last poll from an event stream, if one was ever opened
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    client: str = ""
+    cost: float = 1.0  # estimated cost, in the units of JobQueue's estimate
+    model: str = ""  # jobs on the same model run back to back when fairness allows
+    tag: float = 0.0  # virtual finish time; the smallest eligible tag runs next
+    exception: Optional[BaseException] = field(default=None, repr=False)
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the job's public status fields."""
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'step': self.step,
+            'total_steps': self.total_steps,
+            'preview': self.preview,
+            'error': self.error,
+            'cost': round(self.cost, 3),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """Bounded in-process job queue served by a pool of worker threads.
+
+    Jobs are ordered by start-time fair queueing over their estimated cost: each
+    job's tag is its client's previous tag (or the queue's virtual time, if later)
+    plus its cost, and the eligible job with the smallest tag runs next. Cheap
+    jobs therefore overtake expensive ones, and a client with many jobs queued
+    only pushes back its own later jobs. A job on the model that ran last is
+    preferred over the earliest tag when its tag is within swap_slack of it.
+    Each client may have at most max_client_running jobs running, and at most
+    max_client_cost of cost queued and running. Jobs without a client count as
+    one client ('') and are held to the same limits.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Callable[[Job], Dict[str, Any]]],
+        num_workers: int = 1,
+        max_queued: int = 16,
+        max_finished: int = 256,
+        estimate: Optional[Callable[[str, Dict[str, Any]], Tuple[float, str]]] = None,
+        max_client_running: int = 1,
+        max_client_cost: Optional[float] = None,
+        swap_slack: float = 1.0
+    ):
+        self.handlers = handlers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        # (cost, model) of a job from its kind and params
+        self.estimate = estimate or (lambda kind, params: (1.0, ""))
+        self.max_client_running = max_client_running
+        self.max_client_cost = max_client_cost
+        self.swap_slack = swap_slack
+        self._pending: List[Job] = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._virtual_time = 0.0
+        self._client_tags: Dict[str, float] = {}
+        self._client_running: Dict[str, int] = {}
+        self._client_cost: Dict[str, float] = {}
+        self._last_model: Optional[str] = None
+        self._model_swaps = 0
+        self._workers = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, kind: str, params: Dict[str, Any], options: Optional[Dict[str, Any]] = None,
+               client: str = "") -> Job:
+        """Queue a job and return it immediately, or raise QueueFullError.
+
+        options are passed to the handler on the job but are not handler parameters.
+        A client with nothing queued or running is always under its budget, so a single
+        job costing more than max_client_cost is still accepted.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        cost, model = self.estimate(kind, params)
+        job = Job(kind=kind, params=params, options=options or {}, client=client, cost=cost, model=model)
+        with self._lock:
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError("Job queue is full, try again later")
+            outstanding = self._client_cost.get(client, 0.0)
+            if (self.max_client_cost is not None and outstanding
+                    and outstanding + cost > self.max_client_cost):
+                raise QuotaExceededError("Too much work queued for this client, try again later")
+            job.tag = max(self._virtual_time, self._client_tags.get(client, 0.0)) + cost
+            self._client_tags[client] = job.tag
+            self._client_cost[client] = outstanding + cost
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._ready.notify()
+        return job
+
+    def run(self, kind: str, params: Dict[str, Any], client: str = "") -> Dict[str, Any]:
+        """Queue a job, wait for it and return its result, re-raising the handler's exception."""
+        job = self.submit(kind, params, client=client)
+        job.done.wait()
+        if job.exception is not None:
+            raise job.exception
+        if job.status != "done":
+            raise RuntimeError(job.error or "Job was cancelled")
+        return job.result
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return the job with the given id, if it is still tracked."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Ask a job to stop; queued jobs are dropped at once and running ones abort at their next step."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job in self._pending:
+                self._pending.remove(job)
+                self._release(job)
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                job.done.set()
+        if job is not None and job.finished_at is None:
+            job.cancel_requested = True
+        return job
+
+    def _next(self) -> Optional[Job]:
+        """Pick the next job to run; the lock must be held."""
+        eligible = [job for job in self._pending
+                    if self._client_running.get(job.client, 0) < self.max_client_running]
+        if not eligible:
+            return None
+        best = min(eligible, key=lambda job: job.tag)
+        if best.model != self._last_model:
+            same_model = [job for job in eligible
+                          if job.model == self._last_model and job.tag <= best.tag + self.swap_slack]
+            if same_model:
+                best = min(same_model, key=lambda job: job.tag)
+        return best
+
+    def _release(self, job: Job) -> None:
+        """Return a job's cost to its client's budget; the lock must be held."""
+        client = job.client
+        self._client_cost[client] -= job.cost
+        if self._client_cost[client] <= 1e-9 and not self._client_running.get(client):
+            del self._client_cost[client]
+            # A client that has caught up with the virtual time needs no tag history
+            if self._client_tags.get(client, 0.0) <= self._virtual_time:
+                self._client_tags.pop(client, None)
+
+    def _work(self) -> None:
+        while True:
+            with self._ready:
+                job = self._next()
+                while job is None:
+                    self._ready.wait()
+                    job = self._next()
+                self._pending.remove(job)
+                self._client_running[job.client] = self._client_running.get(job.client, 0) + 1
+                self._virtual_time = max(self._virtual_time, job.tag - job.cost)
+                if self._last_model is not None and job.model != self._last_model:
+                    self._model_swaps += 1
+                self._last_model = job.model
+                job.status = "running"
+                job.started_at = time.time()
+            try:
+                job.result = self.handlers[job.kind](job)
+                job.progress = 1.0
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.exception = e
+                # Handlers abort cancelled jobs by raising from their step callback
+                job.status = "cancelled" if job.cancel_requested else "failed"
+            finally:
+                job.finished_at = time.time()
+                with self._ready:
+                    self._client_running[job.client] -= 1
+                    if not self._client_running[job.client]:
+                        del self._client_running[job.client]
+                    self._release(job)
+                    # The client's next job may have become eligible
+                    self._ready.notify_all()
+                job.done.set()
+                self._prune()
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_finished."""
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, queued cost, model swaps and job counts by status."""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'queued': len(self._pending),
+                'capacity': self.max_queued,
+                'workers': len(self._workers),
+                'queued_cost': round(sum(job.cost for job in self._pending), 3),
+                'clients': len(self._client_cost),
+                'model_swaps': self._model_swaps,
+                'jobs': counts,
+            }
@@ -0,0 +1,240 @@
+import argparse
+import itertools
+import json
+import os
+import secrets
+import sys
+import threading
+import zlib
+from pathlib import Path
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from jobs import QueueFullError, QuotaExceededError
+
+sys.path.append(str(Path(__file__).parent.parent / 'stable-diffusion-project' / 'src'))
+from metrics import merge_exposition
+from image_input import InputImageError
+
+# Service functions web workers may call on the model server
+API = ('save_upload', 'generate_image', 'transform_image', 'submit_job', 'get_job', 'cancel_job', 'ready', 'stats',
+       'metrics')
+
+# Exceptions re-raised as themselves on the client; anything else becomes a RuntimeError
+REMOTE_ERRORS = {
+    'QueueFullError': QueueFullError,
+    'QuotaExceededError': QuotaExceededError,
+    'InputImageError': InputImageError,
+    'ValueError': ValueError,
+}
+
+
+def key_path(address):
+    """File holding a server's generated key, next to its socket."""
+    return f"{address}.key"
+
+
+def read_authkey(address):
+    """The key for a server: MILK_MODEL_SERVER_KEY if set, else the one the server wrote next to its socket."""
+    if os.environ.get('MILK_MODEL_SERVER_KEY'):
+        return os.environ['MILK_MODEL_SERVER_KEY'].encode()
+    with open(key_path(address), 'rb') as f:
+        return f.read()
+
+
+def server_authkey(address):
+    """The key a server listens with: MILK_MODEL_SERVER_KEY if set, else a new random key.
+
+    A generated key is written to <socket>.key readable by its owner only, so only
+    processes running as the same user can authenticate.
+    """
+    if os.environ.get('MILK_MODEL_SERVER_KEY'):
+        return os.environ['MILK_MODEL_SERVER_KEY'].encode()
+    key = secrets.token_hex(32).encode()
+    path = key_path(address)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    os.replace(tmp_path, path)
+    return key
+
+
+class ModelServerClient:
+    """Calls the service functions on one or more model server processes.
+
+    Each web worker thread keeps its own connection per server. Seeded generations
+    are routed to a fixed server so repeats find its result cache; other calls are
+    spread round-robin. Job ids carry the index of the server that owns the job.
+    """
+
+    def __init__(self, addresses, authkey=None):
+        self.addresses = list(addresses)
+        # Without a key, each server's is read when connecting (see read_authkey)
+        self.authkey = authkey
+        self._local = threading.local()
+        self._next = itertools.cycle(range(len(self.addresses)))
+        self._next_lock = threading.Lock()
+
+    def _connection(self, index):
+        connections = self._local.__dict__.setdefault('connections', {})
+        connection = connections.get(index)
+        # Nothing is due on an idle connection, so anything to read means the server closed it
+        if connection is not None and connection.poll():
+            self._drop(index)
+            connection = None
+        if connection is None:
+            address = self.addresses[index]
+            connection = Client(address, family='AF_UNIX', authkey=self.authkey or read_authkey(address))
+            connections[index] = connection
+        return connection
+
+    def _drop(self, index):
+        connection = getattr(self._local, 'connections', {}).pop(index, None)
+        if connection is not None:
+            connection.close()
+
+    def call(self, index, method, **kwargs):
+        """Run a service function on one server and return its result.
+
+        Only connecting is retried. Once a request is sent it is never resent, since
+        the server may already be running it; a lost connection raises RuntimeError.
+        """
+        for attempt in range(2):
+            try:
+                connection = self._connection(index)
+                break
+            except (EOFError, OSError, AuthenticationError) as e:
+                self._drop(index)
+                if attempt:
+                    raise RuntimeError(f"Model server {self.addresses[index]} is unavailable: {e}")
+        try:
+            connection.send((method, kwargs))
+            reply = connection.recv()
+        except (EOFError, OSError):
+            self._drop(index)
+            raise RuntimeError(f"Lost connection to model server {self.addresses[index]}")
+        if reply[0] == 'ok':
+            return reply[1]
+        _, name, message = reply
+        raise REMOTE_ERRORS.get(name, RuntimeError)(message)
+
+    def _pick(self, kwargs):
+        if len(self.addresses) > 1 and kwargs.get('seed', -1) > 0:
+            # Upload bytes and the client are left out; the rest of a seeded request picks the server
+            key = json.dumps({k: v for k, v in kwargs.items() if k not in ('image', 'client')},
+                             sort_keys=True, default=str).encode()
+            return zlib.crc32(key) % len(self.addresses)
+        with self._next_lock:
+            return next(self._next)
+
+    def save_upload(self, data, filename):
+        return self.call(self._pick({}), 'save_upload', data=data, filename=filename)
+
+    def generate_image(self, **kwargs):
+        return self.call(self._pick(kwargs), 'generate_image', **kwargs)
+
+    def transform_image(self, image, **kwargs):
+        return self.call(self._pick(kwargs), 'transform_image', image=image, **kwargs)
+
+    def submit_job(self, kind, params, options=None, client=''):
+        index = self._pick(params)
+        job = self.call(index, 'submit_job', kind=kind, params=params, options=options, client=client)
+        if len(self.addresses) > 1:
+            job['job_id'] = f"{index}-{job['job_id']}"
+        return job
+
+    def _job_call(self, method, job_id, **kwargs):
+        """Call a job method on the server that owns the job."""
+        index = 0
+        if len(self.addresses) > 1:
+            prefix, _, job_id = job_id.partition('-')
+            if not prefix.isdigit() or int(prefix) >= len(self.addresses):
+                return None
+            index = int(prefix)
+        job = self.call(index, method, job_id=job_id, **kwargs)
+        if job is not None and len(self.addresses) > 1:
+            job['job_id'] = f"{index}-{job['job_id']}"
+        return job
+
+    def get_job(self, job_id, watch=False):
+        return self._job_call('get_job', job_id, watch=watch)
+
+    def cancel_job(self, job_id):
+        return self._job_call('cancel_job', job_id)
+
+    def _each(self, method):
+        results = []
+        for index, address in enumerate(self.addresses):
+            try:
+                results.append(dict(self.call(index, method), server=address))
+            except RuntimeError as e:
+                results.append({'server': address, 'error': str(e)})
+        return results
+
+    def ready(self):
+        servers = self._each('ready')
+        if len(servers) == 1 and 'error' not in servers[0]:
+            return servers[0]
+        return {'ready': all(s.get('ready') for s in servers), 'servers': servers}
+
+    def stats(self):
+        servers = self._each('stats')
+        return servers[0] if len(servers) == 1 else {'servers': servers}
+
+    def metrics(self):
+        if len(self.addresses) == 1:
+            return self.call(0, 'metrics')
+        # Each server's samples are labelled with its socket; unreachable servers are left out
+        texts = {}
+        for index, address in enumerate(self.addresses):
+            try:
+                texts[address] = self.call(index, 'metrics')
+            except RuntimeError:
+                continue
+        return merge_exposition(texts)
+
+
+def handle(connection, service):
+    """Serve calls from one web worker connection until it closes."""
+    with connection:
+        while True:
+            try:
+                method, kwargs = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if method not in API:
+                    raise ValueError(f"Unknown model server call: {method}")
+                reply = ('ok', getattr(service, method)(**kwargs))
+            except Exception as e:
+                reply = ('error', type(e).__name__, str(e))
+            try:
+                connection.send(reply)
+            except (EOFError, OSError):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Milk inference in one process shared by all web workers")
+    parser.add_argument("--socket", type=str, default='/tmp/milk-model.sock',
+                        help="Unix socket path to listen on")
+    args = parser.parse_args()
+
+    # Loads config, stores and the job queue, and starts prewarming models
+    import service
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    listener = Listener(args.socket, family='AF_UNIX', authkey=server_authkey(args.socket))
+    print(f"Model server listening on {args.socket}")
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, OSError) as e:
+            print(f"Rejected model server connection: {e}")
+            continue
+        threading.Thread(target=handle, args=(connection, service), daemon=True).start()
+
+
+if __name__ == '__main__':
+    main()
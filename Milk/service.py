@@ -0,0 +1,352 @@
+# Inference side of Milk: model loading, generation, storage and the job queue. The Flask app
+# calls these functions directly, or through model_server when a separate process owns the models.
+import time
+_import_start = time.perf_counter()
+
+import os
+import sys
+from dataclasses import asdict, replace
+from pathlib import Path
+
+# Add the stable-diffusion-project sources to Python path; its modules import each other by top-level name
+sys.path.append(str(Path(__file__).parent.parent / 'stable-diffusion-project' / 'src'))
+from advanced_generation import generate_img2img, generate_refined
+from image_input import prepare_image
+from config.config_manager import ConfigManager
+from config.model_config import DEFAULT_CONFIGS, model_overrides, model_size
+from batching import MicroBatcher
+from seeding import resolve_seeds
+from prompt_cache import prompt_cache
+from image_writer import ImageFormat, ImageWriter
+from output_store import OutputStore
+from result_cache import ResultCache, StoreBackend, result_key
+from startup import Prewarmer, StartupTimer
+from progress import StepProgress, preview_data_url
+from metrics import STAGE_SECONDS, metrics as metrics_registry, track_request
+from jobs import JobQueue
+
+# torch and diffusers are imported lazily, on first generation or by the prewarm thread
+startup = StartupTimer()
+startup.record('imports', time.perf_counter() - _import_start)
+
+# Initialize configuration; requests derive immutable per-request specs from these defaults
+with startup.phase('config'):
+    config_manager = ConfigManager()
+    config = config_manager.load_config()
+
+# Ensure upload directories exist
+UPLOAD_FOLDER = 'static/uploads'
+GENERATED_FOLDER = 'static/generated'
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(GENERATED_FOLDER, exist_ok=True)
+
+# Uploads over these limits are rejected before decoding; accepted ones are downscaled to the model's output area
+MAX_UPLOAD_BYTES = int(os.environ.get('MILK_MAX_UPLOAD_MB', 20)) * 1024 * 1024
+MAX_UPLOAD_PIXELS = int(os.environ.get('MILK_MAX_UPLOAD_PIXELS', 50_000_000))
+
+# Originals kept on request are stored under their own extension when it is one of these
+UPLOAD_EXTENSIONS = ('png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp')
+
+# Compatible text-to-image requests running at the same time share one pipeline call of up to this many
+BATCH_SIZE = int(os.environ.get('MILK_BATCH_SIZE', 4))
+
+# Background job queue sizing; every generation, synchronous or not, runs as a job.
+# One worker per batch slot by default, so concurrent requests can fill a batch
+JOB_WORKERS = int(os.environ.get('MILK_JOB_WORKERS', 0)) or BATCH_SIZE
+JOB_QUEUE_SIZE = int(os.environ.get('MILK_JOB_QUEUE_SIZE', 16))
+
+# Per-client limits, in jobs running at once and in queued plus running cost (see job_cost);
+# requests without a client id share one anonymous client's limits
+CLIENT_MAX_RUNNING = int(os.environ.get('MILK_CLIENT_MAX_RUNNING', 1))
+CLIENT_MAX_COST = float(os.environ.get('MILK_CLIENT_MAX_COST', 32))
+# A job on the model that ran last may overtake the fairest job by this much cost
+MODEL_SWAP_SLACK = float(os.environ.get('MILK_MODEL_SWAP_SLACK', 1))
+
+# Jobs that ask for previews get a latent preview every this many steps
+PREVIEW_EVERY = int(os.environ.get('MILK_PREVIEW_EVERY', 5))
+
+# A job whose event streams have all closed is cancelled once none has reconnected for this many seconds
+STREAM_GRACE = float(os.environ.get('MILK_STREAM_GRACE', 30))
+
+# Generated images are encoded and written off the request thread, by one thread per batch
+# slot by default, so a batch's images are encoded in parallel rather than one after another
+writer = ImageWriter(
+    ImageFormat(
+        format=os.environ.get('MILK_IMAGE_FORMAT', 'png'),
+        quality=int(os.environ.get('MILK_IMAGE_QUALITY', 90)),
+        compress_level=int(os.environ.get('MILK_PNG_COMPRESS_LEVEL', 1)),
+        thumbnail_size=int(os.environ.get('MILK_THUMBNAIL_SIZE', 0)) or None
+    ),
+    max_pending=int(os.environ.get('MILK_WRITE_QUEUE_SIZE', 32)),
+    num_threads=int(os.environ.get('MILK_WRITE_THREADS', 0)) or BATCH_SIZE
+)
+
+# Uploads and results live in sharded, UUID-named stores with a sidecar record per request
+with startup.phase('stores'):
+    output_store = OutputStore(GENERATED_FOLDER, writer)
+    upload_store = OutputStore(UPLOAD_FOLDER, writer)
+
+# Retention keeps disk use bounded; unset limits are not enforced
+RETENTION_MAX_MB = os.environ.get('MILK_RETENTION_MAX_MB')
+RETENTION_MAX_AGE_HOURS = os.environ.get('MILK_RETENTION_MAX_AGE_HOURS')
+UPLOAD_MAX_AGE_HOURS = float(os.environ.get('MILK_UPLOAD_MAX_AGE_HOURS', 24))
+SWEEP_INTERVAL = float(os.environ.get('MILK_SWEEP_INTERVAL', 600))
+if RETENTION_MAX_MB or RETENTION_MAX_AGE_HOURS:
+    output_store.start_sweeper(
+        SWEEP_INTERVAL,
+        max_bytes=int(RETENTION_MAX_MB) * 1024 * 1024 if RETENTION_MAX_MB else None,
+        max_age=float(RETENTION_MAX_AGE_HOURS) * 3600 if RETENTION_MAX_AGE_HOURS else None
+    )
+upload_store.start_sweeper(SWEEP_INTERVAL, max_age=UPLOAD_MAX_AGE_HOURS * 3600)
+
+# Exact repeats of seeded requests are served from records already in the output store
+result_cache = ResultCache(StoreBackend(output_store)) if os.environ.get('MILK_RESULT_CACHE', 'on') != 'off' else None
+
+# Concurrent compatible text-to-image requests are batched into one pipeline call
+batcher = MicroBatcher(
+    max_batch_size=BATCH_SIZE,
+    max_wait=int(os.environ.get('MILK_BATCH_WAIT_MS', 50)) / 1000
+)
+
+def result_response(record, cached=False):
+    """Build the JSON response for a stored output record."""
+    return {
+        'success': True,
+        'images': [f"/static/generated/{name}" for name in record['files']],
+        'thumbnails': [f"/static/generated/{name}" for name in record['thumbnails']],
+        'seeds': record['seeds'],
+        'cached': cached
+    }
+
+def text2img(prompt, negative_prompt='', model='sd-v1-5', scheduler='default', steps=50,
+             guidance=7.5, width=512, height=512, num_images=1, seed=-1, refiner=None,
+             refiner_start=0.8, callback=None):
+    """Run text-to-image generation and save the results.
+
+    With a refiner (e.g. 'sdxl-refiner'), the SDXL base model runs the first
+    refiner_start of the steps and the refiner finishes from its latents.
+    """
+    if refiner and refiner not in DEFAULT_CONFIGS:
+        raise ValueError(f"Unknown refiner: {refiner}")
+    spec = config.to_spec(
+        **model_overrides(model),
+        scheduler=scheduler,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
+        width=width,
+        height=height,
+        num_images=num_images,
+        seed=seed if seed > 0 else None,
+        negative_prompt=negative_prompt
+    )
+
+    with track_request('text2img', spec.model_id):
+        # Exact repeats of a seeded request are served without running diffusion
+        params = dict(asdict(spec), kind='text2img', prompt=prompt)
+        if refiner:
+            params.update(refiner=DEFAULT_CONFIGS[refiner].model_id, refiner_start=refiner_start)
+        key = result_key(params) if result_cache and spec.seed is not None else None
+        record = result_cache.get(key) if key else None
+        if record is not None:
+            return result_response(record, cached=True)
+
+        # Generate images
+        seeds = resolve_seeds(spec.seed, spec.num_images)
+        if refiner:
+            refiner_spec = replace(spec, **model_overrides(refiner))
+            images = generate_refined(spec, refiner_spec, prompt, refiner_start, callback, seeds)
+        else:
+            images = batcher.generate(spec, prompt, seeds=seeds, callback=callback)
+
+        record = output_store.save(images, params, seeds, key=key)
+        if key:
+            result_cache.put(key, record)
+        return result_response(record)
+
+def img2img(image, prompt, negative_prompt='', strength=0.75, model='sd-v1-5',
+            scheduler='default', steps=50, guidance=7.5, num_images=1, seed=-1,
+            callback=None):
+    """Run image-to-image generation on an input image (decoded, bytes or a stored upload's path) and save the results."""
+    spec = config.to_spec(
+        **model_overrides(model),
+        **model_size(model, config),
+        scheduler=scheduler,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
+        num_images=num_images,
+        seed=seed if seed > 0 else None,
+        negative_prompt=negative_prompt
+    )
+
+    with track_request('img2img', spec.model_id):
+        # Decode in memory, straight to the size the model works at
+        init_image = prepare_image(image, max_pixels=spec.width * spec.height,
+                                   max_input_pixels=MAX_UPLOAD_PIXELS, max_input_bytes=MAX_UPLOAD_BYTES)
+
+        # Exact repeats of a seeded request on the same input image are served without running diffusion
+        params = dict(asdict(spec), kind='img2img', prompt=prompt, strength=strength)
+        key = result_key(params, init_image) if result_cache and spec.seed is not None else None
+        record = result_cache.get(key) if key else None
+        if record is not None:
+            return result_response(record, cached=True)
+
+        # Generate images
+        seeds = resolve_seeds(spec.seed, spec.num_images)
+        images = generate_img2img(
+            config=spec,
+            init_image=init_image,
+            prompt=prompt,
+            strength=strength,
+            callback_on_step_end=callback,
+            seeds=seeds
+        )
+
+        record = output_store.save(images, params, seeds, key=key)
+        if key:
+            result_cache.put(key, record)
+        return result_response(record)
+
+def abandoned(job):
+    """Whether a job is cancelled, or was watched by an event stream that has not polled for STREAM_GRACE seconds.
+
+    EventSource reconnects on its own after a network drop, so a closed stream alone
+    does not mean the client has gone.
+    """
+    if job.watched_at is not None and time.time() - job.watched_at > STREAM_GRACE:
+        job.cancel_requested = True
+    return job.cancel_requested
+
+def progress_callback(job):
+    """Build a pipeline step callback that records progress and previews on a job.
+
+    The callback aborts the run at its next step once the job is cancelled or abandoned.
+    """
+    def on_step(progress):
+        job.step = progress.step
+        job.total_steps = progress.total_steps or job.params.get('steps')
+        job.progress = min(progress.step / (job.total_steps or 1), 0.99)
+        if progress.preview is not None and progress.preview_step == progress.step:
+            job.preview = preview_data_url(progress.preview)
+
+    return StepProgress(
+        preview_every=PREVIEW_EVERY if job.options.get('preview') else 0,
+        is_cancelled=lambda: abandoned(job),
+        on_step=on_step
+    ).callback
+
+def run_job(handler):
+    """Wrap a generation function as a job handler that reports progress and queue wait.
+
+    An img2img input image is dropped from the job once it has run, since finished
+    jobs stay listed for a while.
+    """
+    def run(job):
+        model = DEFAULT_CONFIGS[job.params['model']].model_id if job.params.get('model') in DEFAULT_CONFIGS else ''
+        STAGE_SECONDS.observe(job.started_at - job.created_at, stage='queue_wait', model=model)
+        try:
+            return handler(**job.params, callback=progress_callback(job))
+        finally:
+            job.params.pop('image', None)
+    return run
+
+def job_cost(kind, params):
+    """Estimate a job's cost in 512x512, 50-step SD 1.5 images, and name the model it runs on.
+
+    Cost scales with denoising steps (img2img runs strength x steps), output pixels,
+    image count and the model's cost_factor. img2img inputs are resized to the
+    model's native output area, so that is their size. Text-to-image in the draft mode
+    runs its steps at draft_scale squared of the pixels plus draft_strength x steps
+    at full size.
+    """
+    entry = DEFAULT_CONFIGS.get(params.get('model'), config)
+    steps = params.get('steps', 50) * (params.get('strength', 0.75) if kind == 'img2img' else 1.0)
+    if kind == 'img2img':
+        size = model_size(params.get('model'), config)
+        pixels = size['width'] * size['height']
+    else:
+        pixels = params.get('width', config.width) * params.get('height', config.height)
+    draft = entry if entry.draft_pixels is not None else config
+    if kind == 'generate' and draft.draft_pixels is not None and pixels > draft.draft_pixels:
+        steps *= draft.draft_scale ** 2 + draft.draft_strength
+    cost = steps / 50 * pixels / (512 * 512) * params.get('num_images', 1) * entry.cost_factor
+    return cost, params.get('model', '')
+
+job_queue = JobQueue(
+    handlers={
+        'generate': run_job(text2img),
+        'img2img': run_job(img2img),
+    },
+    num_workers=JOB_WORKERS,
+    max_queued=JOB_QUEUE_SIZE,
+    estimate=job_cost,
+    max_client_running=CLIENT_MAX_RUNNING,
+    max_client_cost=CLIENT_MAX_COST,
+    swap_slack=MODEL_SWAP_SLACK
+)
+
+def generate_image(client='', **params):
+    """Run text-to-image generation as a job for a client and wait for its result; params are text2img's."""
+    return job_queue.run('generate', params, client=client)
+
+def transform_image(image, client='', **params):
+    """Run image-to-image generation as a job for a client and wait for its result; params are img2img's."""
+    return job_queue.run('img2img', dict(params, image=image), client=client)
+
+# Models listed in MILK_PREWARM_MODELS (names or model ids) load in the background at startup
+PREWARM_MODELS = [m.strip() for m in os.environ.get('MILK_PREWARM_MODELS', 'sd-v1-5').split(',') if m.strip()]
+prewarmer = Prewarmer(
+    {
+        name: config.to_spec(**model_overrides(name)) if name in DEFAULT_CONFIGS else config.to_spec(model_id=name)
+        for name in PREWARM_MODELS
+    },
+    timer=startup
+)
+prewarmer.start()
+
+# Queue depths and cache occupancy are read from the components' stats() on each scrape;
+# the pipeline and prompt caches register themselves
+metrics_registry.export_stats('milk_jobs', job_queue.stats, counters=('model_swaps',))
+metrics_registry.export_stats('sd_batcher', batcher.stats, counters=('batches', 'requests'))
+metrics_registry.export_stats('sd_writer', writer.stats, counters=('written', 'errors', 'busy_seconds'))
+if result_cache:
+    metrics_registry.export_stats('sd_result_cache', result_cache.stats)
+print(f"Milk started in {time.perf_counter() - _import_start:.2f}s, prewarming {PREWARM_MODELS or 'nothing'}")
+
+def save_upload(data, filename):
+    """Store an original upload's bytes and return their path."""
+    extension = Path(filename or '').suffix.lstrip('.').lower()
+    record = upload_store.save_file(data, extension if extension in UPLOAD_EXTENSIONS else 'png', {'filename': filename})
+    return str(upload_store.root / record['files'][0])
+
+def submit_job(kind, params, options=None, client=''):
+    """Queue a job for a client and return its status, or raise QueueFullError."""
+    return job_queue.submit(kind, params, options, client=client).to_dict()
+
+def cancel_job(job_id):
+    """Cancel a queued or running job and return its status, or None if it is unknown."""
+    job = job_queue.cancel(job_id)
+    return job.to_dict() if job is not None else None
+
+def get_job(job_id, watch=False):
+    """Return a job's status and result, or None if it is unknown; event streams pass watch=True."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return None
+    if watch:
+        job.watched_at = time.time()
+    return dict(job.to_dict(), result=job.result)
+
+def ready():
+    """Return prewarm state and startup timings."""
+    return prewarmer.status()
+
+def metrics():
+    """Return this process's metrics in the Prometheus text format."""
+    return metrics_registry.render()
+
+def stats():
+    """Return queue, batching, cache and storage statistics."""
+    return dict(job_queue.stats(), batching=batcher.stats(),
+                prompt_cache=prompt_cache.stats(), writer=writer.stats(),
+                output_store=output_store.stats(),
+                result_cache=result_cache.stats() if result_cache else None)
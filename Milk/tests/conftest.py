@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Milk's modules import each other by top-level name, as when run from Milk/
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFullError, QuotaExceededError
+
+
+def blocking_queue(**kwargs):
+    """A queue whose jobs run, in the order recorded in `ran`, until `release` is set.
+
+    A job's cost and model come from its params.
+    """
+    release = threading.Event()
+    ran = []
+
+    def handler(job):
+        ran.append(job.params.get("name"))
+        release.wait(5)
+        return {}
+
+    queue = JobQueue({"wait": handler}, estimate=lambda kind, params: (params.get("cost", 1.0), params.get("model", "")),
+                     **kwargs)
+    return queue, release, ran
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def run_in_order(queue, release, jobs):
+    """Hold the single worker on a first job, queue `jobs`, then let them all run."""
+    first = queue.submit("wait", {"name": "first"}, client="first")
+    wait_for(lambda: first.status == "running")
+    submitted = [queue.submit("wait", params, client=client) for client, params in jobs]
+    release.set()
+    for job in submitted:
+        assert job.done.wait(5)
+
+
+def test_cheap_job_overtakes_another_clients_expensive_one():
+    queue, release, ran = blocking_queue()
+    run_in_order(queue, release, [("a", {"name": "big", "cost": 10.0}), ("b", {"name": "small", "cost": 1.0})])
+    assert ran == ["first", "small", "big"]
+
+
+def test_client_with_many_jobs_only_delays_its_own():
+    queue, release, ran = blocking_queue()
+    run_in_order(queue, release, [("a", {"name": "a1"}), ("a", {"name": "a2"}), ("a", {"name": "a3"}),
+                                  ("b", {"name": "b1"})])
+    assert ran.index("b1") < ran.index("a2")
+
+
+def test_same_model_job_preferred_within_swap_slack():
+    queue, release, ran = blocking_queue(swap_slack=1.0)
+    run_in_order(queue, release, [("a", {"name": "other", "model": "y", "cost": 1.0}),
+                                  ("b", {"name": "same", "model": "", "cost": 1.5})])
+    assert ran == ["first", "same", "other"]
+
+
+def test_client_over_cost_budget_is_refused():
+    queue, release, _ = blocking_queue(max_client_cost=4.0)
+    queue.submit("wait", {"cost": 3.0}, client="a")
+    with pytest.raises(QuotaExceededError):
+        queue.submit("wait", {"cost": 2.0}, client="a")
+    queue.submit("wait", {"cost": 2.0}, client="b")
+    release.set()
+
+
+def test_single_job_over_budget_is_accepted_when_client_is_idle():
+    queue, release, _ = blocking_queue(max_client_cost=4.0)
+    queue.submit("wait", {"cost": 10.0}, client="a")
+    release.set()
+
+
+def test_full_queue_is_refused():
+    queue, release, _ = blocking_queue(max_queued=1)
+    first = queue.submit("wait", {}, client="a")
+    wait_for(lambda: first.status == "running")
+    queue.submit("wait", {}, client="b")
+    with pytest.raises(QueueFullError):
+        queue.submit("wait", {}, client="c")
+    release.set()
+
+
+def test_client_running_cap_leaves_workers_to_other_clients():
+    queue, release, _ = blocking_queue(num_workers=2, max_client_running=1)
+    a1 = queue.submit("wait", {}, client="a")
+    a2 = queue.submit("wait", {}, client="a")
+    b1 = queue.submit("wait", {}, client="b")
+    wait_for(lambda: a1.status == "running" and b1.status == "running")
+    assert a2.status == "queued"
+    release.set()
+    assert a2.done.wait(5) and a2.status == "done"
+
+
+def test_anonymous_jobs_share_one_client_quota():
+    queue, release, _ = blocking_queue(num_workers=2, max_client_cost=2.0)
+    queue.submit("wait", {})
+    queue.submit("wait", {})
+    with pytest.raises(QuotaExceededError):
+        queue.submit("wait", {})
+    release.set()
+
+
+def test_anonymous_jobs_share_one_client_running_cap():
+    queue, release, _ = blocking_queue(num_workers=2, max_client_running=1)
+    first = queue.submit("wait", {})
+    second = queue.submit("wait", {})
+    wait_for(lambda: first.status == "running")
+    time.sleep(0.05)
+    assert second.status == "queued"
+    release.set()
+    assert second.done.wait(5) and second.status == "done"
+
+
+def test_cancelled_queued_job_never_runs_and_frees_its_budget():
+    queue, release, ran = blocking_queue(max_client_cost=2.0)
+    first = queue.submit("wait", {"name": "first"}, client="a")
+    wait_for(lambda: first.status == "running")
+    queued = queue.submit("wait", {"name": "queued"}, client="a")
+    queue.cancel(queued.id)
+    assert queued.status == "cancelled"
+    queue.submit("wait", {"name": "next"}, client="a")
+    release.set()
+    wait_for(lambda: len(ran) == 2)
+    assert ran == ["first", "next"]
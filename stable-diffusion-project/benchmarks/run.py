@@ -0,0 +1,416 @@
+"""Benchmark the generation paths offline on CPU against a tiny random-weight model.
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python benchmarks/run.py --output before.json
+    git checkout my-branch
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+MILK_ROOT = ROOT.parent / "Milk"
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from tiny_model import DEFAULT_PATH, make_tiny_model
+
+PROMPT = "a photograph of an astronaut riding a horse"
+SEED = 1234
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    return {
+        "runs": [round(s, 5) for s in seconds],
+        "median": round(statistics.median(seconds), 5),
+        "min": round(min(seconds), 5),
+        "mean": round(statistics.mean(seconds), 5),
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 1, setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """Time fn repeat times after warmup untimed calls; setup runs untimed before each call."""
+    seconds = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        if i >= warmup:
+            seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def case(suite: str, params: Dict[str, Any], timing: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+    name = suite + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]" if params else suite
+    log(f"  {name}: median {timing['median'] * 1000:.1f} ms")
+    return dict(suite=suite, name=name, params=params, seconds=timing, **extra)
+
+
+def make_spec(args: argparse.Namespace, **overrides: Any):
+    from config.model_config import ModelConfig
+    values = dict(model_id=str(args.model), device="cpu", seed=SEED, num_inference_steps=args.steps[0],
+                  width=args.resolutions[0], height=args.resolutions[0])
+    values.update(overrides)
+    return ModelConfig().to_spec(**values)
+
+
+def input_images(size: int):
+    """Deterministic init image and a centered square mask for img2img and inpainting."""
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(SEED)
+    image = Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+    mask = np.zeros((size, size), dtype=np.uint8)
+    mask[size // 4:3 * size // 4, size // 4:3 * size // 4] = 255
+    return image, Image.fromarray(mask)
+
+
+def bench_load(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """get_pipeline from an empty pipeline cache (cold) and from a populated one (warm)."""
+    from generate import get_pipeline
+    from pipeline_registry import registry
+
+    spec = make_spec(args)
+
+    def clear():
+        registry.clear()
+        gc.collect()
+
+    return [
+        case("load", {"cache": "cold"}, measure(lambda: get_pipeline(spec), args.repeat, setup=clear)),
+        case("load", {"cache": "warm"}, measure(lambda: get_pipeline(spec), args.repeat)),
+    ]
+
+
+def bench_text2img(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """One batched text-to-image call per scheduler, step count and resolution."""
+    from batching import BatchRequest, run_text2img_batch
+    from config.model_config import SCHEDULER_MAPPING
+
+    results = []
+    for scheduler in args.schedulers or SCHEDULER_MAPPING:
+        for steps in args.steps:
+            for size in args.resolutions:
+                spec = make_spec(args, scheduler=scheduler, num_inference_steps=steps, width=size, height=size)
+                timing = measure(lambda: run_text2img_batch([BatchRequest(spec, PROMPT, [SEED])]), args.repeat)
+                results.append(case(
+                    "text2img", {"scheduler": scheduler, "steps": steps, "resolution": size}, timing,
+                    seconds_per_step=round(timing["median"] / steps, 5)
+                ))
+    return results
+
+
+def bench_img2img(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """generate_img2img across strengths; strength scales how many steps actually run."""
+    from advanced_generation import generate_img2img
+
+    size = args.resolutions[0]
+    image, _ = input_images(size)
+    spec = make_spec(args)
+    results = []
+    for strength in args.strengths:
+        timing = measure(lambda: generate_img2img(spec, image, PROMPT, strength=strength, seeds=[SEED]), args.repeat)
+        results.append(case("img2img", {"strength": strength, "steps": spec.num_inference_steps, "resolution": size}, timing))
+    return results
+
+
+def bench_inpaint(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from advanced_generation import generate_inpaint
+
+    size = args.resolutions[0]
+    image, mask = input_images(size)
+    spec = make_spec(args)
+    timing = measure(lambda: generate_inpaint(spec, image, mask, PROMPT, seeds=[SEED]), args.repeat)
+    return [case("inpaint", {"steps": spec.num_inference_steps, "resolution": size}, timing)]
+
+
+def bench_flask(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Full HTTP round trips to Milk's /generate from N concurrent clients."""
+    if not (MILK_ROOT / "app.py").exists():
+        log(f"  skipped: Milk not found at {MILK_ROOT}")
+        return []
+
+    # Milk keeps its uploads and outputs relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="sd-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("MILK_PREWARM_MODELS", "")
+    os.environ.setdefault("MILK_RESULT_CACHE", "off")
+    sys.path.insert(0, str(MILK_ROOT))
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as milk
+    from config.model_config import DEFAULT_CONFIGS, ModelConfig
+    DEFAULT_CONFIGS["bench-tiny"] = ModelConfig(model_id=str(args.model))
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, milk.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/generate"
+    size = args.resolutions[0]
+    body = json.dumps({
+        "prompt": PROMPT, "model": "bench-tiny", "steps": args.steps[0],
+        "width": size, "height": size, "seed": SEED,
+    }).encode()
+
+    def post():
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            if not json.load(response).get("success"):
+                raise RuntimeError("Milk /generate failed")
+
+    post()  # load the model outside the timings
+    results = []
+    try:
+        for clients in args.clients:
+            latencies, errors = [], []
+            lock = threading.Lock()
+
+            def client():
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    try:
+                        post()
+                    except Exception as e:
+                        errors.append(str(e))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+            if errors:
+                log(f"  {len(errors)} failed requests: {errors[0]}")
+            latencies.sort()
+            results.append(case(
+                "flask_generate",
+                {"clients": clients, "steps": args.steps[0], "resolution": size},
+                summarize(latencies),
+                p95=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 5) if latencies else None,
+                requests_per_second=round(len(latencies) / wall, 3),
+                errors=len(errors),
+            ))
+    finally:
+        server.shutdown()
+        milk.service.writer.flush()
+    return results
+
+
+def _memory_case(model: str, bounded: bool, size: int, steps: int, threads: int, results) -> None:
+    """Run text2img then img2img at one size in a fresh process, reporting latency and peak RSS growth."""
+    import torch
+    from advanced_generation import generate_img2img
+    from batching import BatchRequest, run_text2img_batch
+    from config.model_config import ModelConfig
+    from metrics import current_rss, rss_tracker
+    from pipeline_family import get_pipeline_family
+
+    if threads:
+        torch.set_num_threads(threads)
+    spec = ModelConfig(model_id=model, device="cpu", memory_bounded=bounded).to_spec(
+        num_inference_steps=steps, width=size, height=size, seed=SEED)
+    get_pipeline_family(spec)
+    baseline = current_rss()
+    timings = {}
+    with rss_tracker.track() as rss:
+        for attempt in range(2):
+            start = time.perf_counter()
+            image = run_text2img_batch([BatchRequest(spec, PROMPT, [SEED])])[0][0]
+            timings["text2img"] = time.perf_counter() - start
+            start = time.perf_counter()
+            generate_img2img(spec, image, PROMPT, strength=1.0, seeds=[SEED])
+            timings["img2img"] = time.perf_counter() - start
+    results.put({"seconds": timings, "peak_rss_growth_bytes": rss["peak"] - baseline})
+
+
+def bench_memory(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Peak memory and latency with the memory-bounded mode off and on, one fresh process per case.
+
+    Peak RSS is measured from after the model is loaded, so it covers the working
+    memory of generation rather than the weights. Timings are from the second of
+    two runs.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in args.memory_resolutions:
+        for bounded in (False, True):
+            queue = context.Queue()
+            process = context.Process(
+                target=_memory_case, args=(str(args.model), bounded, size, args.steps[0], args.threads, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                log(f"  memory case at {size}px (bounded={bounded}) failed with exit code {process.exitcode}")
+                continue
+            measured = queue.get()
+            for kind, seconds in measured["seconds"].items():
+                results.append(case(
+                    "memory", {"kind": kind, "memory_bounded": bounded, "steps": args.steps[0], "resolution": size},
+                    summarize([seconds]), peak_rss_growth_bytes=measured["peak_rss_growth_bytes"]
+                ))
+    return results
+
+
+def bench_draft(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Direct text2img against draft-then-upscale, upscaling the image or the latents, at each size."""
+    from batching import BatchRequest, run_text2img_batch
+
+    results = []
+    for size in args.draft_resolutions:
+        for mode in ("direct", "image", "latent"):
+            draft = {} if mode == "direct" else {"draft_pixels": 0, "draft_upscale": mode}
+            spec = make_spec(args, width=size, height=size, **draft)
+            timing = measure(lambda: run_text2img_batch([BatchRequest(spec, PROMPT, [SEED])]), args.repeat)
+            results.append(case("draft", {"mode": mode, "steps": spec.num_inference_steps, "resolution": size}, timing))
+    return results
+
+
+SUITES = {
+    "load": bench_load,
+    "text2img": bench_text2img,
+    "img2img": bench_img2img,
+    "inpaint": bench_inpaint,
+    "flask": bench_flask,
+    "memory": bench_memory,
+    "draft": bench_draft,
+}
+
+
+def environment() -> Dict[str, Any]:
+    """Describe the code and machine a run measured, so results are only compared like for like."""
+    import diffusers
+    import torch
+
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Log median ratios against a baseline run and return the names of cases that regressed."""
+    before = {r["name"]: r["seconds"]["median"] for r in baseline["results"]}
+    regressions = []
+    log(f"{'case':<60} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for result in results["results"]:
+        name, median = result["name"], result["seconds"]["median"]
+        if name not in before:
+            log(f"{name:<60} {'-':>10} {median:>10.4f} {'new':>7}")
+            continue
+        ratio = median / before[name] if before[name] else float("inf")
+        flag = " slower" if ratio > threshold else ""
+        log(f"{name:<60} {before[name]:>10.4f} {median:>10.4f} {ratio:>7.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generation paths on CPU with a tiny random-weight model")
+    parser.add_argument("--suites", type=lambda v: v.split(","), default=list(SUITES),
+                        help=f"Comma-separated suites to run (default: {','.join(SUITES)})")
+    parser.add_argument("--model", type=Path, default=DEFAULT_PATH,
+                        help="Tiny model directory; built on first use")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, after one warmup run")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument("--schedulers", type=lambda v: v.split(","), default=None,
+                        help="Schedulers for the text2img suite (default: all of SCHEDULER_MAPPING)")
+    parser.add_argument("--steps", type=int_list, default=[10, 25], help="Step counts for the text2img suite")
+    parser.add_argument("--resolutions", type=int_list, default=[64, 128],
+                        help="Square image sizes for the text2img suite; the first is used elsewhere")
+    parser.add_argument("--strengths", type=float_list, default=[0.3, 0.6, 1.0], help="img2img strengths")
+    parser.add_argument("--memory-resolutions", type=int_list, default=[256, 512],
+                        help="Square image sizes for the memory suite")
+    parser.add_argument("--draft-resolutions", type=int_list, default=[128, 256],
+                        help="Sizes for the draft suite, direct and draft-then-upscale")
+    parser.add_argument("--clients", type=int_list, default=[1, 4], help="Concurrent clients for the flask suite")
+    parser.add_argument("--requests", type=int, default=4, help="Requests per client for the flask suite")
+    parser.add_argument("--output", type=Path, default=None, help="Write results JSON here (default: stdout)")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="Baseline results JSON; exits non-zero if any case is slower than --threshold")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Median ratio counted as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(SEED)
+    args.model = make_tiny_model(args.model.resolve())
+    # The flask suite changes the working directory
+    args.output = args.output.resolve() if args.output else None
+    args.compare = args.compare.resolve() if args.compare else None
+
+    results = {"environment": environment(), "config": {}, "results": []}
+    results["config"] = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+                         if k not in ("output", "compare", "threshold")}
+    for suite in args.suites:
+        log(f"{suite}:")
+        results["results"].extend(SUITES[suite](args))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text + "\n")
+        log(f"Results written to {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            log(f"{len(regressions)} case(s) slower than {args.threshold}x the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Build a tiny random-weight Stable Diffusion model for offline CPU benchmarks.
+
+The model has the same components and interfaces as SD 1.x (CLIP tokenizer and
+text encoder, UNet, VAE, scheduler) at a fraction of the size, so every
+generation path runs end to end in milliseconds without downloading weights.
+Its images are noise; only timings are meaningful.
+"""
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent / "models" / "tiny-sd"
+
+
+def make_tokenizer(directory: Path):
+    """Build a CLIP tokenizer over the byte-level alphabet, with no merges, so every character is a token."""
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    chars = list(bytes_to_unicode().values())
+    vocab = {}
+    for suffix in ("", "</w>"):
+        for char in chars:
+            vocab[char + suffix] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "vocab.json").write_text(json.dumps(vocab))
+    (directory / "merges.txt").write_text("#version: 0.2\n")
+    return CLIPTokenizer(str(directory / "vocab.json"), str(directory / "merges.txt"), model_max_length=77)
+
+
+def make_tiny_model(path: Path = DEFAULT_PATH, seed: int = 0) -> Path:
+    """Save a tiny SD pipeline to path, reusing it if already built, and return the path."""
+    path = Path(path)
+    if (path / "model_index.json").exists():
+        return path
+
+    import torch
+    from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    torch.manual_seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        tokenizer = make_tokenizer(Path(tmp))
+    vocab = tokenizer.get_vocab()
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(vocab),
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        max_position_embeddings=77,
+        bos_token_id=vocab["<|startoftext|>"],
+        eos_token_id=vocab["<|endoftext|>"],
+        pad_token_id=1,
+    ))
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        attention_head_dim=4,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        up_block_types=["UpDecoderBlock2D"] * 2,
+        latent_channels=4,
+        sample_size=64,
+    )
+    scheduler = PNDMScheduler(skip_prk_steps=True, steps_offset=1)
+    pipe = StableDiffusionPipeline(
+        unet=unet,
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipe.save_pretrained(str(path))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a tiny random-weight Stable Diffusion model")
+    parser.add_argument("path", nargs="?", type=Path, default=DEFAULT_PATH, help="Directory to save the model to")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random weights")
+    args = parser.parse_args()
+    print(f"Tiny model saved to {make_tiny_model(args.path, args.seed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,234 @@
-import torch
+from typing import Any, Callable, List, Optional
 from PIL import Image
-from diffusers import (
-    StableDiffusionImg2ImgPipeline,
-    StableDiffusionInpaintPipeline,
-    StableDiffusionXLImg2ImgPipeline,
-    StableDiffusionXLInpaintPipeline
-)
-from config.model_config import ModelConfig, SCHEDULER_MAPPING
-
-def get_img2img_pipeline(config: ModelConfig):
-    """Initialize the appropriate img2img pipeline based on model configuration."""
-    if "xl" in config.model_id.lower():
-        pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(config.model_id)
-    else:
-        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(config.model_id)
-    
-    # Set scheduler if specified
-    if config.scheduler != "default" and config.scheduler in SCHEDULER_MAPPING:
-        scheduler_class = SCHEDULER_MAPPING[config.scheduler]
-        pipe.scheduler = scheduler_class.from_config(pipe.scheduler.config)
-    
-    pipe = pipe.to(config.device)
-    return pipe
+from config.model_config import GenerationSpec
+from pipeline_family import get_pipeline_family, get_refiner_family, is_xl_model
+from seeding import resolve_seeds, make_generators
+from prompt_cache import prompt_cache
+from metrics import call_pipeline
+from progress import stage_callback
 
-def get_inpaint_pipeline(config: ModelConfig):
-    """Initialize the appropriate inpainting pipeline based on model configuration."""
-    if "xl" in config.model_id.lower():
-        pipe = StableDiffusionXLInpaintPipeline.from_pretrained(config.model_id)
-    else:
-        pipe = StableDiffusionInpaintPipeline.from_pretrained(config.model_id)
-    
-    # Set scheduler if specified
-    if config.scheduler != "default" and config.scheduler in SCHEDULER_MAPPING:
-        scheduler_class = SCHEDULER_MAPPING[config.scheduler]
-        pipe.scheduler = scheduler_class.from_config(pipe.scheduler.config)
-    
-    pipe = pipe.to(config.device)
-    return pipe
+def get_img2img_pipeline(config: GenerationSpec):
+    """Return the img2img pipeline from the model's cached pipeline family."""
+    family = get_pipeline_family(config)
+    return family.pipeline("img2img", config.scheduler)
 
-def prepare_image(image_path: str, target_size: tuple = None) -> Image.Image:
-    """Load and prepare an image for processing."""
-    image = Image.open(image_path).convert("RGB")
-    if target_size:
-        image = image.resize(target_size, Image.Resampling.LANCZOS)
-    return image
+def get_inpaint_pipeline(config: GenerationSpec):
+    """Return the inpainting pipeline from the model's cached pipeline family."""
+    family = get_pipeline_family(config)
+    return family.pipeline("inpaint", config.scheduler)
 
 def generate_img2img(
-    config: ModelConfig,
+    config: GenerationSpec,
     init_image: Image.Image,
     prompt: str,
-    strength: float = 0.75
+    strength: float = 0.75,
+    callback_on_step_end: Optional[Callable] = None,
+    seeds: Optional[List[int]] = None
 ) -> list[Image.Image]:
-    """Generate images using image-to-image generation."""
-    pipe = get_img2img_pipeline(config)
-    
-    # Set random seed if specified
-    if config.seed is not None:
-        torch.manual_seed(config.seed)
-        if config.device == "cuda":
-            torch.cuda.manual_seed(config.seed)
+    """Generate images using image-to-image generation.
+
+    Pass seeds (one per image, see seeding.resolve_seeds) to know each image's
+    effective seed; otherwise they are derived from config.seed.
+    """
+    # Seed each image with its own generator
+    if seeds is None:
+        seeds = resolve_seeds(config.seed, config.num_images)
     
-    images = pipe(
-        prompt=prompt,
-        negative_prompt=config.negative_prompt,
-        image=init_image,
+    # One row per seed: per-image generators need a matching image batch
+    return run_img2img(
+        config,
+        [init_image] * len(seeds),
+        [prompt] * len(seeds),
+        [config.negative_prompt] * len(seeds),
+        strength,
+        seeds,
+        callback_on_step_end
+    )
+
+def run_img2img(
+    config: GenerationSpec,
+    images: List[Any],
+    prompts: List[str],
+    negative_prompts: List[str],
+    strength: float,
+    seeds: List[int],
+    callback_on_step_end: Optional[Callable] = None
+) -> list[Image.Image]:
+    """Run one img2img pipeline call with a row per seed, each with its own input and prompt pair.
+
+    Inputs may be PIL images or latents of shape (1, 4, h, w), which are noised directly.
+    """
+    pipe = get_img2img_pipeline(config)
+    return call_pipeline(
+        pipe, config,
+        **prompt_cache.embeddings(pipe, config.model_id, prompts, negative_prompts),
+        image=images,
         strength=strength,
         num_inference_steps=config.num_inference_steps,
         guidance_scale=config.guidance_scale,
-        num_images_per_prompt=config.num_images
+        generator=make_generators(seeds),
+        callback_on_step_end=callback_on_step_end
     ).images
-    
-    return images
 
 def generate_inpaint(
-    config: ModelConfig,
+    config: GenerationSpec,
     init_image: Image.Image,
     mask_image: Image.Image,
-    prompt: str
+    prompt: str,
+    callback_on_step_end: Optional[Callable] = None,
+    seeds: Optional[List[int]] = None
 ) -> list[Image.Image]:
-    """Generate images using inpainting."""
-    pipe = get_inpaint_pipeline(config)
-    
-    # Set random seed if specified
-    if config.seed is not None:
-        torch.manual_seed(config.seed)
-        if config.device == "cuda":
-            torch.cuda.manual_seed(config.seed)
+    """Generate images using inpainting, seeded like generate_img2img."""
+    # Seed each image with its own generator
+    if seeds is None:
+        seeds = resolve_seeds(config.seed, config.num_images)
     
-    images = pipe(
-        prompt=prompt,
-        negative_prompt=config.negative_prompt,
-        image=init_image,
-        mask_image=mask_image,
+    # One row per seed: per-image generators need a matching image batch
+    return run_inpaint(
+        config,
+        [init_image] * len(seeds),
+        [mask_image] * len(seeds),
+        [prompt] * len(seeds),
+        [config.negative_prompt] * len(seeds),
+        seeds,
+        callback_on_step_end
+    )
+
+def run_inpaint(
+    config: GenerationSpec,
+    images: List[Image.Image],
+    masks: List[Image.Image],
+    prompts: List[str],
+    negative_prompts: List[str],
+    seeds: List[int],
+    callback_on_step_end: Optional[Callable] = None,
+    strength: float = 1.0
+) -> list[Image.Image]:
+    """Run one inpainting call with a row per seed; all images must share one size, which the output keeps."""
+    pipe = get_inpaint_pipeline(config)
+    return call_pipeline(
+        pipe, config,
+        **prompt_cache.embeddings(pipe, config.model_id, prompts, negative_prompts),
+        image=images,
+        mask_image=masks,
+        height=images[0].height,
+        width=images[0].width,
+        strength=strength,
         num_inference_steps=config.num_inference_steps,
         guidance_scale=config.guidance_scale,
-        num_images_per_prompt=config.num_images
+        generator=make_generators(seeds),
+        callback_on_step_end=callback_on_step_end
     ).images
-    
-    return images 
\ No newline at end of file
+
+def generate_refined(
+    config: GenerationSpec,
+    refiner_config: GenerationSpec,
+    prompt: str,
+    refiner_start: float = 0.8,
+    callback_on_step_end: Optional[Callable] = None,
+    seeds: Optional[List[int]] = None
+) -> list[Image.Image]:
+    """Generate with an SDXL base model and finish with its refiner, handing over latents.
+
+    The base model runs the first refiner_start fraction of the denoising schedule
+    and returns undecoded latents; the refiner, which shares the base's second text
+    encoder and VAE, denoises the rest and decodes once. Seeded like generate_img2img;
+    step callbacks see one run of config.num_inference_steps.
+    """
+    if not is_xl_model(config.model_id) or "refiner" in config.model_id.lower():
+        raise ValueError(f"The refiner needs an SDXL base model, not {config.model_id}")
+    base = get_pipeline_family(config).pipeline("text2img", config.scheduler)
+    refiner = get_refiner_family(refiner_config, config).pipeline("img2img", refiner_config.scheduler)
+
+    # Seed each image with its own generator; the refiner continues from the same generator state
+    if seeds is None:
+        seeds = resolve_seeds(config.seed, config.num_images)
+    generators = make_generators(seeds)
+    total_steps = config.num_inference_steps
+
+    latents = call_pipeline(
+        base, config,
+        **prompt_cache.embeddings(
+            base, config.model_id, [prompt] * len(seeds), [config.negative_prompt] * len(seeds)
+        ),
+        num_inference_steps=total_steps,
+        denoising_end=refiner_start,
+        output_type="latent",
+        guidance_scale=config.guidance_scale,
+        width=config.width,
+        height=config.height,
+        generator=generators,
+        callback_on_step_end=stage_callback(callback_on_step_end, 0, total_steps)
+    ).images
+
+    images = call_pipeline(
+        refiner, refiner_config,
+        **prompt_cache.embeddings(
+            refiner, refiner_config.model_id, [prompt] * len(seeds), [config.negative_prompt] * len(seeds)
+        ),
+        image=latents,
+        num_inference_steps=total_steps,
+        denoising_start=refiner_start,
+        guidance_scale=config.guidance_scale,
+        generator=generators,
+        callback_on_step_end=stage_callback(callback_on_step_end, base.num_timesteps, total_steps)
+    ).images
+
+    return images
+
+def uses_draft(config: GenerationSpec) -> bool:
+    """Whether a text2img spec runs in the draft-then-upscale mode."""
+    return config.draft_pixels is not None and config.width * config.height > config.draft_pixels
+
+def draft_size(config: GenerationSpec) -> tuple:
+    """Size of the draft pass: draft_scale of each side, rounded down to a multiple of 8."""
+    return (max(8, int(config.width * config.draft_scale) // 8 * 8),
+            max(8, int(config.height * config.draft_scale) // 8 * 8))
+
+def draft_then_upscale(
+    config: GenerationSpec,
+    prompts: List[str],
+    negative_prompts: List[str],
+    seeds: List[int],
+    callback_on_step_end: Optional[Callable] = None
+) -> list[Image.Image]:
+    """Generate large images by composing a small draft, upscaling it and refining it with img2img.
+
+    The draft runs all of config's steps at draft_size; it is upscaled to the full size
+    as an image (decode, Lanczos resize, encode) or as latents (bicubic, no VAE round
+    trip), and refined by a draft_strength img2img pass over the same loaded weights.
+    One row per seed; step callbacks see one run covering both passes.
+    """
+    import torch
+
+    pipe = get_pipeline_family(config).pipeline("text2img", config.scheduler)
+    width, height = draft_size(config)
+    latent_mode = config.draft_upscale == "latent"
+    refine_steps = int(config.num_inference_steps * config.draft_strength)
+    total_steps = config.num_inference_steps + refine_steps
+
+    drafts = call_pipeline(
+        pipe, config,
+        **prompt_cache.embeddings(pipe, config.model_id, prompts, negative_prompts),
+        num_inference_steps=config.num_inference_steps,
+        guidance_scale=config.guidance_scale,
+        width=width,
+        height=height,
+        output_type="latent" if latent_mode else "pil",
+        generator=make_generators(seeds),
+        callback_on_step_end=stage_callback(callback_on_step_end, 0, total_steps)
+    ).images
+
+    if latent_mode:
+        scale = pipe.vae_scale_factor
+        size = (config.height // scale, config.width // scale)
+        upscaled = [torch.nn.functional.interpolate(drafts[i:i + 1], size=size, mode="bicubic")
+                    for i in range(len(seeds))]
+    else:
+        upscaled = [draft.resize((config.width, config.height), Image.Resampling.LANCZOS) for draft in drafts]
+
+    return run_img2img(
+        config, upscaled, prompts, negative_prompts, config.draft_strength, seeds,
+        stage_callback(callback_on_step_end, config.num_inference_steps, total_steps)
+    )
+
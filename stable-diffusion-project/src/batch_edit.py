@@ -0,0 +1,264 @@
+import argparse
+import csv
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+from config.config_manager import ConfigManager
+from config.model_config import DEFAULT_CONFIGS, GenerationSpec, ModelConfig, model_overrides, model_size
+from advanced_generation import run_img2img, run_inpaint
+from image_input import prepare_image
+from seeding import resolve_seeds
+from image_writer import ImageFormat, ImageWriter
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+
+# Manifest fields and the types they are read as (CSV values arrive as strings)
+ITEM_FIELDS = {
+    "image": str,
+    "mask": str,
+    "prompt": str,
+    "negative_prompt": str,
+    "strength": float,
+    "seed": int,
+}
+
+
+def image_files(directory: Path) -> Dict[str, Path]:
+    """Images directly in a directory, keyed by file stem.
+
+    Raises ValueError when two images share a stem (a.jpg and a.png), since items
+    and their outputs are named by stem.
+    """
+    files: Dict[str, Path] = {}
+    for p in sorted(directory.iterdir()):
+        if p.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if p.stem in files:
+            raise ValueError(f"{files[p.stem]} and {p} share the name {p.stem!r}; rename one")
+        files[p.stem] = p
+    return files
+
+
+def read_items(source: str, mask_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield input items from an image directory or a JSONL/CSV manifest.
+
+    Directory items take their mask from the image with the same stem in mask_dir,
+    if any. Manifest paths are relative to the manifest; rows may also set prompt,
+    negative_prompt, strength, seed and id. Raises ValueError on a repeated id, as
+    its items would write the same output.
+    """
+    masks = image_files(Path(mask_dir)) if mask_dir else {}
+    path = Path(source)
+    if path.is_dir():
+        for stem, image in image_files(path).items():
+            item = {"id": stem, "image": image}
+            if stem in masks:
+                item["mask"] = masks[stem]
+            yield item
+        return
+
+    with open(path, newline="") as f:
+        if source.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        ids = set()
+        for row in rows:
+            item = {k: ITEM_FIELDS[k](v) for k, v in row.items() if k in ITEM_FIELDS and v not in ("", None)}
+            if not item.get("image"):
+                continue
+            item["image"] = path.parent / item["image"]
+            if "mask" in item:
+                item["mask"] = path.parent / item["mask"]
+            elif item["image"].stem in masks:
+                item["mask"] = masks[item["image"].stem]
+            item["id"] = str(row.get("id") or item["image"].stem)
+            if item["id"] in ids:
+                raise ValueError(f"Id {item['id']!r} appears more than once in {source}; give the rows distinct ids")
+            ids.add(item["id"])
+            yield item
+
+
+def edit_spec(config: ModelConfig, args: argparse.Namespace) -> GenerationSpec:
+    """Build the spec shared by every item from the loaded defaults and the command line."""
+    model_defaults = DEFAULT_CONFIGS.get(args.model, config)
+    return config.to_spec(
+        **(model_overrides(args.model) if args.model in DEFAULT_CONFIGS else {"model_id": args.model}),
+        **model_size(args.model, config),
+        num_inference_steps=args.steps or model_defaults.num_inference_steps,
+        guidance_scale=args.guidance or model_defaults.guidance_scale,
+        num_images=1,
+        seed=args.seed,
+        negative_prompt=args.negative_prompt if args.negative_prompt is not None else config.negative_prompt
+    )
+
+
+def load_item(item: Dict[str, Any], target_size: Optional[Tuple[int, int]], max_pixels: int,
+              multiple: int) -> Tuple[Optional[Image.Image], Optional[Image.Image], float]:
+    """Read, decode and resize an item's image and mask; runs on the prefetch threads.
+
+    Returns the image, the mask (None without one) and the seconds spent. A file
+    that cannot be read comes back as no image, so one bad input never stops the run.
+    """
+    start = time.perf_counter()
+    try:
+        image = prepare_image(item["image"], target_size=target_size, max_pixels=max_pixels, multiple=multiple)
+        mask = prepare_image(item["mask"], target_size=image.size) if "mask" in item else None
+    except (OSError, ValueError) as e:
+        print(f"Skipping {item['image']}: {e}")
+        image, mask = None, None
+    return image, mask, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run img2img or inpainting over a directory or manifest of images")
+    parser.add_argument("inputs", type=str, help="Image directory, or JSONL/CSV manifest with image, mask, prompt, negative_prompt, strength, seed, id")
+    parser.add_argument("--masks", type=str, help="Directory of inpainting masks, paired with inputs by file stem")
+    parser.add_argument("--prompt", type=str, default="", help="Prompt for inputs that do not set one")
+    parser.add_argument("--negative-prompt", type=str, help="Negative prompt for inputs that do not set one")
+    parser.add_argument("--strength", type=float, help="Strength for inputs that do not set one (default 0.75, or 1.0 with a mask)")
+    parser.add_argument("--seed", type=int, help="Seed for inputs that do not set one (random if omitted)")
+    parser.add_argument("--model", type=str, default="sd-v1-5", help="Model name or id")
+    parser.add_argument("--steps", type=int, help="Number of inference steps")
+    parser.add_argument("--guidance", type=float, help="Guidance scale")
+    parser.add_argument("--size", type=str, help="Resize every input to WIDTHxHEIGHT, so all inputs batch together")
+    parser.add_argument("--multiple", type=int, default=64, help="Without --size, round each side down to this multiple so similar inputs share a size")
+    parser.add_argument("--output-dir", type=str, default="assets/edits", help="Directory to write images and results.jsonl to")
+    parser.add_argument("--batch-size", type=int, default=4, help="Maximum images per pipeline call")
+    parser.add_argument("--workers", type=int, default=4, help="Threads reading and resizing inputs ahead of inference")
+    parser.add_argument("--prefetch", type=int, help="Inputs to read ahead of inference (default 4 batches)")
+    parser.add_argument("--overwrite", action="store_true", help="Reprocess inputs whose images already exist")
+    parser.add_argument("--format", type=str, choices=["png", "webp", "jpeg"], default="png", help="Output image format")
+    parser.add_argument("--quality", type=int, default=90, help="WebP/JPEG quality")
+    parser.add_argument("--thumbnail", type=int, help="Also write a thumbnail with this longest side")
+    args = parser.parse_args()
+
+    image_format = ImageFormat(format=args.format, quality=args.quality, thumbnail_size=args.thumbnail)
+    writer = ImageWriter(image_format, num_threads=2)
+
+    config = ConfigManager().load_config(args.model)
+    spec = edit_spec(config, args)
+    target_size = tuple(int(v) for v in args.size.lower().split("x")) if args.size else None
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Resume: skip inputs whose output is on disk from a previous run
+    pending, skipped = [], 0
+    for item in read_items(args.inputs, args.masks):
+        if not args.overwrite and (output_dir / f"{item['id']}.{image_format.extension}").exists():
+            skipped += 1
+            continue
+        pending.append(item)
+    print(f"{len(pending)} inputs to run, {skipped} already done")
+
+    # Inputs are read and resized on a thread pool up to `prefetch` items ahead, so the
+    # next batches are ready by the time inference finishes the current one. Loaded
+    # inputs wait in one bucket per mode, size and strength until a batch fills; when
+    # more than `prefetch` are waiting, the fullest bucket runs early to bound memory.
+    prefetch = args.prefetch or 4 * args.batch_size
+    loader = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="input-loader")
+    inputs = iter(pending)
+    loading = deque()
+    buckets: Dict[tuple, List[tuple]] = {}
+    stats = {"loaded": 0, "failed": 0, "load_seconds": 0.0, "input_wait": 0.0,
+             "inferred": 0, "infer_seconds": 0.0, "output_wait": 0.0}
+
+    def fill():
+        while len(loading) < prefetch:
+            item = next(inputs, None)
+            if item is None:
+                return
+            loading.append((item, loader.submit(load_item, item, target_size, spec.width * spec.height, args.multiple)))
+
+    def run_batch(key, batch, results):
+        mode, _, strength = key
+        items = [item for item, _, _ in batch]
+        images = [image for _, image, _ in batch]
+        prompts = [item.get("prompt", args.prompt) for item in items]
+        negative_prompts = [item.get("negative_prompt", spec.negative_prompt) for item in items]
+        seeds = [resolve_seeds(item.get("seed", spec.seed), 1)[0] for item in items]
+
+        start = time.perf_counter()
+        if mode == "inpaint":
+            outputs = run_inpaint(spec, images, [mask for _, _, mask in batch], prompts, negative_prompts, seeds, strength=strength)
+        else:
+            outputs = run_img2img(spec, images, prompts, negative_prompts, strength, seeds)
+        stats["infer_seconds"] += time.perf_counter() - start
+
+        # Writes happen in the background; time spent here means the writer fell behind
+        start = time.perf_counter()
+        for item, prompt, seed, output in zip(items, prompts, seeds, outputs):
+            path, _ = writer.write(output, output_dir / f"{item['id']}.{image_format.extension}")
+            results.write(json.dumps({
+                "id": item["id"],
+                "input": str(item["image"]),
+                "mask": str(item["mask"]) if "mask" in item else None,
+                "prompt": prompt,
+                "model_id": spec.model_id,
+                "strength": strength,
+                "seed": seed,
+                "size": list(output.size),
+                "file": str(path),
+            }) + "\n")
+        results.flush()
+        stats["output_wait"] += time.perf_counter() - start
+        stats["inferred"] += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"[{stats['inferred']}/{len(pending)}] {mode} {len(batch)}x{images[0].width}x{images[0].height} "
+              f"({stats['inferred'] / elapsed:.2f} images/s, waited {stats['input_wait']:.1f}s on input)")
+
+    started = time.perf_counter()
+    fill()
+    with open(output_dir / "results.jsonl", "a") as results:
+        while loading:
+            item, future = loading.popleft()
+            start = time.perf_counter()
+            image, mask, seconds = future.result()
+            stats["input_wait"] += time.perf_counter() - start
+            fill()
+            stats["load_seconds"] += seconds
+            if image is None:
+                stats["failed"] += 1
+                continue
+            stats["loaded"] += 1
+
+            mode = "inpaint" if mask is not None else "img2img"
+            strength = item.get("strength", args.strength if args.strength is not None else (1.0 if mask is not None else 0.75))
+            key = (mode, image.size, strength)
+            buckets.setdefault(key, []).append((item, image, mask))
+            if len(buckets[key]) >= args.batch_size:
+                run_batch(key, buckets.pop(key), results)
+            elif sum(len(batch) for batch in buckets.values()) > prefetch:
+                # Buckets keep insertion order, so max() picks the oldest of the fullest
+                fullest = max(buckets, key=lambda k: len(buckets[k]))
+                run_batch(fullest, buckets.pop(fullest), results)
+
+        # Partly filled buckets run once every input has been read
+        for key, batch in list(buckets.items()):
+            run_batch(key, batch, results)
+    loader.shutdown()
+    writer.flush()
+
+    elapsed = time.perf_counter() - started
+    write = writer.stats()
+
+    def rate(count, seconds):
+        return f"{count / seconds:.2f} images/s" if seconds else "-"
+
+    print(f"Processed {stats['inferred']} images in {elapsed:.1f}s ({rate(stats['inferred'], elapsed)}), "
+          f"{stats['failed']} unreadable, {write['errors']} failed to write")
+    print(f"  load:      {rate(stats['loaded'] + stats['failed'], stats['load_seconds'] / args.workers)} "
+          f"with {args.workers} threads ({rate(stats['loaded'] + stats['failed'], stats['load_seconds'])} per thread)")
+    print(f"  inference: {rate(stats['inferred'], stats['infer_seconds'])}, "
+          f"waited {stats['input_wait']:.1f}s on input and {stats['output_wait']:.1f}s on output")
+    print(f"  write:     {rate(write['written'], write['busy_seconds'] / 2)} with 2 threads "
+          f"({rate(write['written'], write['busy_seconds'])} per thread)")
+
+
+if __name__ == "__main__":
+    main()
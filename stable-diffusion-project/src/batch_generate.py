@@ -0,0 +1,153 @@
+import argparse
+import csv
+import hashlib
+import json
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from config.config_manager import ConfigManager
+from config.model_config import DEFAULT_CONFIGS, GenerationSpec, ModelConfig, model_overrides
+from batching import BatchRequest, batch_key, run_text2img_batch
+from seeding import resolve_seeds
+from image_writer import ImageFormat, ImageWriter
+
+# Job fields and the types they are read as (CSV values arrive as strings)
+JOB_FIELDS = {
+    "prompt": str,
+    "negative_prompt": str,
+    "model": str,
+    "scheduler": str,
+    "steps": int,
+    "guidance": float,
+    "width": int,
+    "height": int,
+    "num_images": int,
+    "seed": int,
+}
+
+
+def read_jobs(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield jobs from a JSONL or CSV file, with typed fields and a stable id.
+
+    Raises ValueError on a repeated explicit id, as its jobs would write the same files.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        ids = set()
+        repeats: Dict[str, int] = {}
+        for row in rows:
+            job = {k: JOB_FIELDS[k](v) for k, v in row.items() if k in JOB_FIELDS and v not in ("", None)}
+            if not job.get("prompt"):
+                continue
+            if row.get("id"):
+                job["id"] = str(row["id"])
+                if job["id"] in ids:
+                    raise ValueError(f"Id {job['id']!r} appears more than once in {path}; give the rows distinct ids")
+            else:
+                # Hash the job itself so reruns of the same file map to the same outputs;
+                # identical rows (re-rolls of an unseeded prompt) are told apart by how
+                # many came before them
+                digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()[:16]
+                repeat = repeats.get(digest, 0)
+                repeats[digest] = repeat + 1
+                job["id"] = f"{digest}-{repeat}" if repeat else digest
+            ids.add(job["id"])
+            yield job
+
+
+def job_spec(config: ModelConfig, job: Dict[str, Any], default_model: str) -> GenerationSpec:
+    """Build the generation spec for a job from the loaded defaults."""
+    model = job.get("model", default_model)
+    model_defaults = DEFAULT_CONFIGS.get(model, config)
+    return config.to_spec(
+        **(model_overrides(model) if model in DEFAULT_CONFIGS else {"model_id": model}),
+        scheduler=job.get("scheduler", config.scheduler),
+        num_inference_steps=job.get("steps", model_defaults.num_inference_steps),
+        guidance_scale=job.get("guidance", model_defaults.guidance_scale),
+        width=job.get("width", model_defaults.width),
+        height=job.get("height", model_defaults.height),
+        num_images=job.get("num_images", 1),
+        seed=job.get("seed"),
+        negative_prompt=job.get("negative_prompt", config.negative_prompt)
+    )
+
+
+def output_paths(output_dir: Path, job_id: str, count: int, extension: str = "png") -> List[Path]:
+    return [output_dir / f"{job_id}_{i}.{extension}" for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate images for every job in a JSONL or CSV file")
+    parser.add_argument("jobs", type=str, help="JSONL or CSV file with prompt, negative_prompt, seed, steps, width, height, model, ...")
+    parser.add_argument("--output-dir", type=str, default="assets/batch", help="Directory to write images and results.jsonl to")
+    parser.add_argument("--model", type=str, default="sd-v1-5", help="Model for jobs that do not name one")
+    parser.add_argument("--batch-size", type=int, default=4, help="Maximum images per pipeline call")
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate jobs whose images already exist")
+    parser.add_argument("--format", type=str, choices=["png", "webp", "jpeg"], default="png", help="Output image format")
+    parser.add_argument("--quality", type=int, default=90, help="WebP/JPEG quality")
+    parser.add_argument("--thumbnail", type=int, help="Also write a thumbnail with this longest side")
+    args = parser.parse_args()
+
+    # Images are written atomically in the background, so an interrupted run never leaves a
+    # partial file under a final name and resuming stays safe
+    image_format = ImageFormat(format=args.format, quality=args.quality, thumbnail_size=args.thumbnail)
+    writer = ImageWriter(image_format, num_threads=2)
+
+    config = ConfigManager().load_config(args.model)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Resume: skip jobs whose images are all on disk from a previous run
+    pending, skipped = [], 0
+    for job in read_jobs(args.jobs):
+        spec = job_spec(config, job, args.model)
+        if not args.overwrite and all(p.exists() for p in output_paths(output_dir, job["id"], spec.num_images, image_format.extension)):
+            skipped += 1
+            continue
+        pending.append((job, spec))
+    print(f"{len(pending)} jobs to run, {skipped} already done")
+
+    # Group by model and resolution so each model loads once and compatible jobs batch together
+    def group_key(item):
+        return batch_key(item[1])
+
+    pending.sort(key=group_key)
+    done, start = 0, time.perf_counter()
+    with open(output_dir / "results.jsonl", "a") as results:
+        for _, group in groupby(pending, key=group_key):
+            group = list(group)
+            while group:
+                batch, size = [], 0
+                while group and (not batch or size + group[0][1].num_images <= args.batch_size):
+                    job, spec = group.pop(0)
+                    batch.append((job, BatchRequest(spec, job["prompt"], resolve_seeds(spec.seed, spec.num_images))))
+                    size += spec.num_images
+
+                outputs = run_text2img_batch([req for _, req in batch])
+
+                # Stream each job's images to the writer as soon as its batch finishes
+                for (job, req), images in zip(batch, outputs):
+                    paths = output_paths(output_dir, job["id"], len(images), image_format.extension)
+                    for image, path in zip(images, paths):
+                        writer.write(image, path)
+                    results.write(json.dumps({
+                        "id": job["id"],
+                        "prompt": job["prompt"],
+                        "model_id": req.spec.model_id,
+                        "seeds": req.seeds,
+                        "files": [str(p) for p in paths],
+                    }) + "\n")
+                    results.flush()
+                    done += 1
+                    elapsed = time.perf_counter() - start
+                    print(f"[{done}/{len(pending)}] {job['id']} -> {paths[0].name} ({elapsed / done:.1f}s/job)")
+    writer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+from config.model_config import GenerationSpec
+from generate import get_pipeline
+from advanced_generation import draft_then_upscale, uses_draft
+from seeding import resolve_seeds, make_generators
+from prompt_cache import prompt_cache
+from progress import GenerationCancelled
+from metrics import STAGE_SECONDS, call_pipeline
+
+
+def batch_key(spec: GenerationSpec) -> tuple:
+    """Specs with equal keys can share one pipeline call."""
+    return (spec.model_id, spec.device, spec.scheduler, spec.width, spec.height,
+            spec.num_inference_steps, spec.guidance_scale,
+            spec.draft_pixels, spec.draft_scale, spec.draft_strength, spec.draft_upscale)
+
+
+@dataclass
+class BatchRequest:
+    spec: GenerationSpec
+    prompt: str
+    seeds: List[int]
+    callback: Optional[Callable] = None
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def key(self) -> tuple:
+        return batch_key(self.spec)
+
+
+def run_text2img_batch(requests: List[BatchRequest]) -> List[List[Image.Image]]:
+    """Run compatible text2img requests as one pipeline call and split the images back."""
+    config = requests[0].spec
+    prompts, negative_prompts, seeds = [], [], []
+    for req in requests:
+        prompts.extend([req.prompt] * len(req.seeds))
+        negative_prompts.extend([req.spec.negative_prompt] * len(req.seeds))
+        seeds.extend(req.seeds)
+
+    # Each request's callback sees only its own rows of the latents. A request whose
+    # callback raises GenerationCancelled is failed right away and dropped from the
+    # callbacks; the shared pipeline call is aborted only once every request is cancelled.
+    cancelled = set()
+
+    def callback(pipe, step, timestep, callback_kwargs):
+        start = 0
+        for i, req in enumerate(requests):
+            rows = slice(start, start + len(req.seeds))
+            start += len(req.seeds)
+            if req.callback is None or i in cancelled:
+                continue
+            req_kwargs = dict(callback_kwargs)
+            if "latents" in req_kwargs:
+                req_kwargs["latents"] = req_kwargs["latents"][rows]
+            try:
+                req.callback(pipe, step, timestep, req_kwargs)
+            except GenerationCancelled as e:
+                cancelled.add(i)
+                req.future.set_exception(e)
+        if len(cancelled) == len(requests):
+            raise GenerationCancelled("Every request in the batch was cancelled")
+        return callback_kwargs
+
+    if uses_draft(config):
+        images = draft_then_upscale(config, prompts, negative_prompts, seeds, callback)
+    else:
+        pipe = get_pipeline(config)
+        images = call_pipeline(
+            pipe, config,
+            **prompt_cache.embeddings(pipe, config.model_id, prompts, negative_prompts),
+            num_inference_steps=config.num_inference_steps,
+            guidance_scale=config.guidance_scale,
+            width=config.width,
+            height=config.height,
+            generator=make_generators(seeds),
+            callback_on_step_end=callback
+        ).images
+
+    results, start = [], 0
+    for req in requests:
+        results.append(images[start:start + len(req.seeds)])
+        start += len(req.seeds)
+    return results
+
+
+class MicroBatcher:
+    """Groups concurrent compatible requests into batched pipeline calls.
+
+    A batch is dispatched when it holds max_batch_size images or when its oldest
+    request has waited max_wait seconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 4,
+        max_wait: float = 0.05,
+        run_batch: Callable[[List[BatchRequest]], List[Any]] = run_text2img_batch
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.run_batch = run_batch
+        self._pending: List[BatchRequest] = []
+        self._cond = threading.Condition()
+        self._fills: deque = deque(maxlen=1000)
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, spec: GenerationSpec, prompt: str, seeds: Optional[List[int]] = None,
+               callback: Optional[Callable] = None) -> Future:
+        """Queue a request and return a future resolving to its images, one per seed."""
+        if seeds is None:
+            seeds = resolve_seeds(spec.seed, spec.num_images)
+        req = BatchRequest(spec, prompt, seeds, callback)
+        with self._cond:
+            self._pending.append(req)
+            self._cond.notify()
+        return req.future
+
+    def generate(self, *args: Any, **kwargs: Any) -> List[Image.Image]:
+        """Submit a request and wait for its images."""
+        return self.submit(*args, **kwargs).result()
+
+    def _take_batch(self) -> List[BatchRequest]:
+        """Wait for a batch to fill or time out, then remove it from pending (lock held)."""
+        while not self._pending:
+            self._cond.wait()
+        first = self._pending[0]
+        deadline = first.enqueued_at + self.max_wait
+        while True:
+            batch, size = [], 0
+            for req in self._pending:
+                if req.key == first.key and (not batch or size + len(req.seeds) <= self.max_batch_size):
+                    batch.append(req)
+                    size += len(req.seeds)
+            remaining = deadline - time.monotonic()
+            if size >= self.max_batch_size or remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        for req in batch:
+            self._pending.remove(req)
+        self._fills.append(min(size / self.max_batch_size, 1.0))
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            # Requests whose futures were cancelled while queued are not run
+            batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            now = time.monotonic()
+            for req in batch:
+                STAGE_SECONDS.observe(now - req.enqueued_at, stage="batch_wait", model=req.spec.model_id)
+            try:
+                results = self.run_batch(batch)
+            except Exception as e:
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+                continue
+            for req, result in zip(batch, results):
+                if not req.future.done():
+                    req.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return batch counts and how full dispatched batches were."""
+        fills = list(self._fills)
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "pending": len(self._pending),
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+            "mean_fill": round(sum(fills) / len(fills), 3) if fills else None,
+        }
@@ -1,14 +1,5 @@
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
-from diffusers import (
-    DDIMScheduler,
-    DPMSolverMultistepScheduler,
-    EulerAncestralDiscreteScheduler,
-    EulerDiscreteScheduler,
-    LMSDiscreteScheduler,
-    PNDMScheduler,
-    UniPCMultistepScheduler
-)
 
 @dataclass
 class ModelConfig:
@@ -22,11 +13,63 @@ class ModelConfig:
     scheduler: str = "default"  # Options: "default", "ddim", "euler", "euler_a", "dpm++", "lms", "pndm", "unipc"
     negative_prompt: str = ""
     num_images: int = 1
+    # Inference profile, applied when a pipeline is loaded
+    precision: str = "fp32"  # Options: "fp32", "bf16", "fp16" (fp16 falls back to fp32 on CPU)
+    channels_last: bool = False
+    compile: bool = False
+    intra_op_threads: Optional[int] = None
+    attention_slicing: bool = False
+    # Memory-bounded mode: tiled VAE and query-chunked attention, always or for requests above a pixel count
+    memory_bounded: bool = False
+    memory_bounded_pixels: Optional[int] = None
+    # Draft-then-upscale for text2img above draft_pixels (0 for every size): compose at draft_scale
+    # of the size, upscale the "image" or "latent", then refine with a draft_strength img2img pass
+    draft_pixels: Optional[int] = None
+    draft_scale: float = 0.5
+    draft_strength: float = 0.35
+    draft_upscale: str = "image"
+    # Relative cost of one denoising step per output pixel, used to schedule requests fairly
+    cost_factor: float = 1.0
     
     @classmethod
     def from_dict(cls, config_dict: Dict[str, Any]) -> 'ModelConfig':
         return cls(**{k: v for k, v in config_dict.items() if k in cls.__dataclass_fields__})
 
+    def to_spec(self, **overrides: Any) -> 'GenerationSpec':
+        """Snapshot these defaults into an immutable per-request spec."""
+        return GenerationSpec.from_config(self, **overrides)
+
+@dataclass(frozen=True)
+class GenerationSpec:
+    """Immutable settings for one generation request, derived from ModelConfig defaults."""
+    model_id: str
+    device: str
+    num_inference_steps: int
+    guidance_scale: float
+    width: int
+    height: int
+    seed: Optional[int]
+    scheduler: str
+    negative_prompt: str
+    num_images: int
+    precision: str = "fp32"
+    channels_last: bool = False
+    compile: bool = False
+    intra_op_threads: Optional[int] = None
+    attention_slicing: bool = False
+    memory_bounded: bool = False
+    memory_bounded_pixels: Optional[int] = None
+    draft_pixels: Optional[int] = None
+    draft_scale: float = 0.5
+    draft_strength: float = 0.35
+    draft_upscale: str = "image"
+
+    @classmethod
+    def from_config(cls, config: ModelConfig, **overrides: Any) -> 'GenerationSpec':
+        values = {k: getattr(config, k) for k in cls.__dataclass_fields__}
+        values.update(overrides)
+        return cls(**values)
+
 # Default configurations for different models
 DEFAULT_CONFIGS = {
     "sd-v1-5": ModelConfig(
@@ -44,7 +87,8 @@ DEFAULT_CONFIGS = {
         num_inference_steps=50,
         guidance_scale=7.5,
         width=1024,
-        height=1024
+        height=1024,
+        cost_factor=2.0
     ),
     "sd-v1-4": ModelConfig(
         model_id="CompVis/stable-diffusion-v1-4",
@@ -61,17 +105,44 @@ DEFAULT_CONFIGS = {
         num_inference_steps=50,
         guidance_scale=7.5,
         width=1024,
-        height=1024
+        height=1024,
+        cost_factor=2.0
     )
 }
 
-# Scheduler mapping
+def model_overrides(name: str) -> Dict[str, Any]:
+    """Spec overrides for a named model: its id, plus the memory-bounded and draft modes if its entry enables them."""
+    entry = DEFAULT_CONFIGS[name]
+    overrides: Dict[str, Any] = {"model_id": entry.model_id}
+    if entry.memory_bounded:
+        overrides["memory_bounded"] = True
+    if entry.memory_bounded_pixels:
+        overrides["memory_bounded_pixels"] = entry.memory_bounded_pixels
+    if entry.draft_pixels is not None:
+        overrides.update(draft_pixels=entry.draft_pixels, draft_scale=entry.draft_scale,
+                         draft_strength=entry.draft_strength, draft_upscale=entry.draft_upscale)
+    return overrides
+
+def model_size(name: str, fallback: ModelConfig) -> Dict[str, int]:
+    """Native width and height of a named model (fallback's for other names); img2img and inpainting inputs are bounded by their area."""
+    entry = DEFAULT_CONFIGS.get(name, fallback)
+    return {"width": entry.width, "height": entry.height}
+
+# Scheduler mapping to diffusers class names; classes are imported on first use to keep startup fast
 SCHEDULER_MAPPING = {
-    "ddim": DDIMScheduler,
-    "dpm++": DPMSolverMultistepScheduler,
-    "euler": EulerDiscreteScheduler,
-    "euler_a": EulerAncestralDiscreteScheduler,
-    "lms": LMSDiscreteScheduler,
-    "pndm": PNDMScheduler,
-    "unipc": UniPCMultistepScheduler
-} 
\ No newline at end of file
+    "ddim": "DDIMScheduler",
+    "dpm++": "DPMSolverMultistepScheduler",
+    "euler": "EulerDiscreteScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+    "lms": "LMSDiscreteScheduler",
+    "pndm": "PNDMScheduler",
+    "unipc": "UniPCMultistepScheduler"
+}
+
+def get_scheduler_class(name: str) -> Optional[Any]:
+    """Return the diffusers scheduler class for a scheduler name, or None if unknown."""
+    if name not in SCHEDULER_MAPPING:
+        return None
+    import diffusers
+    return getattr(diffusers, SCHEDULER_MAPPING[name])
+ 
\ No newline at end of file
@@ -1,25 +1,20 @@
 import argparse
-import torch
-from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline
+from dataclasses import replace
 from prompts import get_default_prompt
 from utils import get_output_path
 from config.config_manager import ConfigManager
-from config.model_config import ModelConfig, SCHEDULER_MAPPING
+from config.model_config import DEFAULT_CONFIGS, GenerationSpec, model_overrides, model_size
+from pipeline_family import get_pipeline_family, is_xl_model
+from seeding import resolve_seeds, make_generators
+from prompt_cache import prompt_cache
+from image_writer import ImageFormat, ImageWriter
+from metrics import call_pipeline
+from advanced_generation import draft_then_upscale, generate_refined, uses_draft
 
-def get_pipeline(config: ModelConfig):
-    """Initialize the appropriate pipeline based on model configuration."""
-    if "xl" in config.model_id.lower():
-        pipe = StableDiffusionXLPipeline.from_pretrained(config.model_id)
-    else:
-        pipe = StableDiffusionPipeline.from_pretrained(config.model_id)
-    
-    # Set scheduler if specified
-    if config.scheduler != "default" and config.scheduler in SCHEDULER_MAPPING:
-        scheduler_class = SCHEDULER_MAPPING[config.scheduler]
-        pipe.scheduler = scheduler_class.from_config(pipe.scheduler.config)
-    
-    pipe = pipe.to(config.device)
-    return pipe
+def get_pipeline(config: GenerationSpec):
+    """Return the text-to-image pipeline from the model's cached pipeline family."""
+    family = get_pipeline_family(config)
+    return family.pipeline("text2img", config.scheduler)
 
 def main():
     parser = argparse.ArgumentParser(description="Generate images with Stable Diffusion")
@@ -34,58 +29,84 @@ def main():
     parser.add_argument("--num-images", type=int, default=1, help="Number of images to generate")
     parser.add_argument("--width", type=int, help="Image width")
     parser.add_argument("--height", type=int, help="Image height")
+    parser.add_argument("--refiner", type=str, help="Finish SDXL images with this refiner model (e.g. sdxl-refiner)")
+    parser.add_argument("--refiner-start", type=float, default=0.8, help="Fraction of the steps run by the base model before the refiner takes over")
+    parser.add_argument("--draft", action="store_true", help="Compose a small draft, upscale it and refine it with img2img")
+    parser.add_argument("--draft-scale", type=float, help="Draft size as a fraction of each side (default 0.5)")
+    parser.add_argument("--draft-strength", type=float, help="Strength of the refining img2img pass (default 0.35)")
+    parser.add_argument("--draft-upscale", choices=["image", "latent"], help="Upscale the decoded draft or its latents")
+    parser.add_argument("--format", type=str, choices=["png", "webp", "jpeg"], default="png", help="Output image format")
+    parser.add_argument("--quality", type=int, default=90, help="WebP/JPEG quality")
+    parser.add_argument("--thumbnail", type=int, help="Also write a thumbnail with this longest side")
     args = parser.parse_args()
 
     # Initialize configuration
     config_manager = ConfigManager()
     config = config_manager.load_config(args.model)
 
-    # Update config with command line arguments
-    if args.steps:
-        config.num_inference_steps = args.steps
-    if args.guidance:
-        config.guidance_scale = args.guidance
-    if args.seed:
-        config.seed = args.seed
-    if args.scheduler:
-        config.scheduler = args.scheduler
-    if args.negative_prompt:
-        config.negative_prompt = args.negative_prompt
-    if args.num_images:
-        config.num_images = args.num_images
-    if args.width:
-        config.width = args.width
-    if args.height:
-        config.height = args.height
+    # Build the generation spec from the named model's defaults and the command line arguments
+    model = model_overrides(args.model) if args.model in DEFAULT_CONFIGS else {"model_id": args.model}
+    model.update(model_size(args.model, config))
+    overrides = {
+        "num_inference_steps": args.steps,
+        "guidance_scale": args.guidance,
+        "seed": args.seed,
+        "scheduler": args.scheduler,
+        "negative_prompt": args.negative_prompt,
+        "num_images": args.num_images,
+        "width": args.width,
+        "height": args.height,
+        "draft_scale": args.draft_scale,
+        "draft_strength": args.draft_strength,
+        "draft_upscale": args.draft_upscale,
+    }
+    config = config.to_spec(**dict(model, **{k: v for k, v in overrides.items() if v}))
+    if args.draft:
+        config = replace(config, draft_pixels=0)
+    if args.refiner and args.refiner not in DEFAULT_CONFIGS:
+        parser.error(f"Unknown refiner {args.refiner}; choose one of {', '.join(DEFAULT_CONFIGS)}")
+    if args.refiner and (not is_xl_model(config.model_id) or "refiner" in config.model_id.lower()):
+        parser.error(f"--refiner needs an SDXL base model (e.g. --model sdxl), not {args.model}")
 
     # Get prompt
     prompt = args.prompt if args.prompt else get_default_prompt(args.type)
 
     # Initialize pipeline
     pipe = get_pipeline(config)
+    family = get_pipeline_family(config)
+    print(f"Optimizations: {', '.join(family.optimizations)}")
+    load = family.load_info
+    print(f"Loaded from {load['source']} in {load['seconds']}s, peak RSS {load['peak_rss_bytes'] / 2**20:.0f} MiB")
 
-    # Set random seed if specified
-    if config.seed is not None:
-        torch.manual_seed(config.seed)
-        if config.device == "cuda":
-            torch.cuda.manual_seed(config.seed)
+    # Seed each image with its own generator
+    seeds = resolve_seeds(config.seed, config.num_images)
 
-    # Generate images
-    images = pipe(
-        prompt,
-        negative_prompt=config.negative_prompt,
-        num_inference_steps=config.num_inference_steps,
-        guidance_scale=config.guidance_scale,
-        width=config.width,
-        height=config.height,
-        num_images_per_prompt=config.num_images
-    ).images
+    # Generate images; with a refiner the base hands its latents over instead of decoding
+    if args.refiner:
+        refiner_config = replace(config, **model_overrides(args.refiner))
+        images = generate_refined(config, refiner_config, prompt, args.refiner_start, seeds=seeds)
+    elif uses_draft(config):
+        images = draft_then_upscale(config, [prompt] * len(seeds), [config.negative_prompt] * len(seeds), seeds)
+    else:
+        images = call_pipeline(
+            pipe, config,
+            **prompt_cache.embeddings(pipe, config.model_id, [prompt], [config.negative_prompt]),
+            num_inference_steps=config.num_inference_steps,
+            guidance_scale=config.guidance_scale,
+            width=config.width,
+            height=config.height,
+            num_images_per_prompt=len(seeds),
+            generator=make_generators(seeds)
+        ).images
 
-    # Save images
+    # Save images; encoding runs in the background while the next image is queued
+    image_format = ImageFormat(format=args.format, quality=args.quality, thumbnail_size=args.thumbnail)
+    writer = ImageWriter(image_format)
     for i, image in enumerate(images):
-        output_path = get_output_path(args.type, index=i if len(images) > 1 else None)
-        image.save(output_path)
-        print(f"Image {i+1} saved to {output_path}")
+        output_path = get_output_path(args.type, index=i if len(images) > 1 else None, extension=image_format.extension)
+        output_path, _ = writer.write(image, output_path)
+        print(f"Image {i+1} (seed {seeds[i]}) saved to {output_path}")
+    writer.flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
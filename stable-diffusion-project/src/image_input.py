@@ -0,0 +1,75 @@
+import io
+import math
+import os
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple, Union
+
+from PIL import Image
+
+# Inputs over these limits are rejected before their pixels are decoded
+MAX_INPUT_PIXELS = int(os.environ.get("SD_MAX_INPUT_PIXELS", 50_000_000))
+MAX_INPUT_BYTES = int(os.environ.get("SD_MAX_INPUT_MB", 20)) * 1024 * 1024
+
+ImageSource = Union[str, Path, bytes, BinaryIO, Image.Image]
+
+
+class InputImageError(ValueError):
+    """Raised when an input image is over the byte or pixel limit."""
+
+
+def check_bytes(size: int, max_bytes: int) -> None:
+    if size > max_bytes:
+        raise InputImageError(f"Image is larger than {max_bytes / (1024 * 1024):g} MB")
+
+
+def read_limited(stream: BinaryIO, max_bytes: int) -> bytes:
+    """Read a stream to the end, raising InputImageError once it passes max_bytes."""
+    data = stream.read(max_bytes + 1)
+    check_bytes(len(data), max_bytes)
+    return data
+
+
+def bounded_size(width: int, height: int, max_pixels: Optional[int] = None, multiple: int = 8) -> Tuple[int, int]:
+    """Largest size with the image's aspect ratio within max_pixels, each side rounded down to a multiple."""
+    scale = min(1.0, math.sqrt(max_pixels / (width * height))) if max_pixels else 1.0
+    return (
+        max(multiple, int(width * scale) // multiple * multiple),
+        max(multiple, int(height * scale) // multiple * multiple),
+    )
+
+
+def prepare_image(
+    source: ImageSource,
+    target_size: Optional[Tuple[int, int]] = None,
+    max_pixels: Optional[int] = None,
+    multiple: int = 8,
+    max_input_pixels: int = MAX_INPUT_PIXELS,
+    max_input_bytes: int = MAX_INPUT_BYTES,
+) -> Image.Image:
+    """Decode an input image (path, bytes, file object or PIL image) to RGB at a bounded size.
+
+    Byte and pixel limits are checked from the file size and header, before decoding.
+    The image is resized once: to target_size if given, otherwise to fit within
+    max_pixels with both sides a multiple of `multiple`. JPEGs are decoded at the
+    smallest reduced scale (draft mode) that still covers the output size.
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (str, Path)):
+        check_bytes(os.path.getsize(source), max_input_bytes)
+        image = Image.open(source)
+    elif isinstance(source, bytes):
+        check_bytes(len(source), max_input_bytes)
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(io.BytesIO(read_limited(source, max_input_bytes)))
+
+    if image.width * image.height > max_input_pixels:
+        raise InputImageError(f"Image is {image.width}x{image.height}, over the {max_input_pixels} pixel limit")
+
+    size = tuple(target_size) if target_size else bounded_size(image.width, image.height, max_pixels, multiple)
+    image.draft("RGB", size)
+    image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return image
@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from metrics import timed
+
+
+@dataclass(frozen=True)
+class ImageFormat:
+    """How generated images are encoded on disk."""
+    format: str = "png"  # Options: "png", "webp", "jpeg"
+    quality: int = 90  # webp/jpeg quality
+    compress_level: int = 1  # png zlib level; 1 is far faster than PIL's default 6 for little size cost
+    thumbnail_size: Optional[int] = None  # longest side of an extra thumbnail rendition
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    def save_kwargs(self) -> Dict[str, Any]:
+        if self.format == "png":
+            return {"format": "PNG", "compress_level": self.compress_level}
+        if self.format == "webp":
+            return {"format": "WEBP", "quality": self.quality, "method": 4}
+        return {"format": "JPEG", "quality": self.quality, "optimize": True}
+
+
+def thumbnail_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}_thumb{path.suffix}")
+
+
+class ImageWriter:
+    """Encodes and writes images on background threads behind a bounded queue.
+
+    write() returns the final paths immediately; files appear under those names
+    only once fully written. When the queue is full, write() blocks, which keeps
+    memory bounded if encoding falls behind generation.
+    """
+
+    def __init__(self, image_format: ImageFormat = ImageFormat(), max_pending: int = 32, num_threads: int = 1):
+        self.image_format = image_format
+        self._queue: "queue.Queue[Tuple[Image.Image, Path, ImageFormat]]" = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.last_error: Optional[str] = None
+        self._threads = [
+            threading.Thread(target=self._work, name=f"image-writer-{i}", daemon=True)
+            for i in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def write(self, image: Image.Image, path: Path,
+              image_format: Optional[ImageFormat] = None) -> Tuple[Path, Optional[Path]]:
+        """Queue an image for writing; path's suffix is replaced by the format's extension.
+
+        Returns the image path and the thumbnail path (None without thumbnails).
+        """
+        path, thumb, _ = self.submit(image, path, image_format)
+        return path, thumb
+
+    def submit(self, image: Image.Image, path: Path,
+               image_format: Optional[ImageFormat] = None) -> Tuple[Path, Optional[Path], Future]:
+        """Queue an image like write(), also returning a future that completes once its files are in place.
+
+        The future's exception is the write's error, if it failed.
+        """
+        image_format = image_format or self.image_format
+        path = Path(path).with_suffix(f".{image_format.extension}")
+        done: Future = Future()
+        self._queue.put((image, path, image_format, done))
+        thumb = thumbnail_path(path) if image_format.thumbnail_size else None
+        return path, thumb, done
+
+    def flush(self) -> None:
+        """Block until every queued image has been written."""
+        self._queue.join()
+
+    def _work(self) -> None:
+        while True:
+            image, path, image_format, done = self._queue.get()
+            start = time.perf_counter()
+            try:
+                with timed("save"):
+                    save_image(image, path, image_format)
+                self.written += 1
+                done.set_result(path)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{path}: {e}"
+                print(f"Failed to write {path}: {e}")
+                done.set_exception(e)
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "last_error": self.last_error,
+        }
+
+
+def save_image(image: Image.Image, path: Path, image_format: ImageFormat = ImageFormat()) -> None:
+    """Encode an image (and its thumbnail) and move it into place atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if image_format.format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    renditions = [(image, path)]
+    if image_format.thumbnail_size:
+        thumb = image.copy()
+        thumb.thumbnail((image_format.thumbnail_size, image_format.thumbnail_size), Image.Resampling.LANCZOS)
+        renditions.append((thumb, thumbnail_path(path)))
+    for rendition, target in renditions:
+        tmp_path = target.with_name(f".{target.name}.tmp")
+        rendition.save(tmp_path, **image_format.save_kwargs())
+        os.replace(tmp_path, target)
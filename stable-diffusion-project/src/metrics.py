@@ -0,0 +1,355 @@
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a single denoising step up to a cold model load
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(7, 16))  # 128 MiB .. 32 GiB
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.label_names, key), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: Any) -> None:
+        """Mirror a running total kept elsewhere (e.g. a cache's hit count)."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                yield f"{self.name}_bucket", labels, count
+            yield f"{self.name}_sum", _format_labels(self.label_names, key), total
+            yield f"{self.name}_count", _format_labels(self.label_names, key), counts[-1]
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format.
+
+    Collectors registered with on_collect() run before each render, so gauges
+    that mirror other components' stats are refreshed only when scraped.
+    """
+
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> Any:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def export_stats(self, prefix: str, stats: Callable[[], Dict[str, Any]],
+                     counters: Sequence[str] = ("hits", "misses", "evictions")) -> None:
+        """Mirror the numeric fields of a component's stats() dict as {prefix}_{field} on each scrape.
+
+        Fields named in counters are exported as counters (running totals), the rest as gauges.
+        """
+        def collect():
+            for name, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if name in counters:
+                    self.counter(f"{prefix}_{name}_total", f"{prefix} {name}").set(value)
+                else:
+                    self.gauge(f"{prefix}_{name}", f"{prefix} {name}").set(value)
+
+        self.on_collect(collect)
+
+    def render(self) -> str:
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def merge_exposition(texts: Dict[str, str], label: str = "server") -> str:
+    """Merge several processes' exposition texts, telling their samples apart by a label."""
+    families: "OrderedDict[str, List[str]]" = OrderedDict()
+    headers: Dict[str, List[str]] = {}
+    for value, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = line.split()[2]
+                headers.setdefault(family, [])
+                if len(headers[family]) < 2:
+                    headers[family].append(line)
+                families.setdefault(family, [])
+            elif line and family is not None:
+                name, _, rest = line.rpartition(" ")
+                pair = f'{label}="{_escape(value)}"'
+                if "{" in name:
+                    name = name.replace("{", "{" + pair + ",", 1)
+                else:
+                    name = name + "{" + pair + "}"
+                families[family].append(f"{name} {rest}")
+    lines = []
+    for family, samples in families.items():
+        lines.extend(headers[family])
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "sd_stage_seconds", "Time spent in each generation stage", ["stage", "model"])
+STEP_SECONDS = metrics.histogram(
+    "sd_denoise_step_seconds", "Seconds per denoising step", ["model", "scheduler", "resolution"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0))
+REQUEST_PEAK_RSS = metrics.histogram(
+    "sd_request_peak_rss_bytes", "Peak process resident memory while a request ran", ["kind"],
+    buckets=BYTES_BUCKETS)
+REQUESTS = metrics.counter("sd_requests_total", "Generation requests by kind and outcome", ["kind", "outcome"])
+FAILURES = metrics.counter("sd_failures_total", "Requests that did not complete, by kind and exception type", ["kind", "error"])
+PROCESS_RSS = metrics.gauge("sd_process_resident_memory_bytes", "Current process resident memory")
+PROCESS_PEAK_RSS = metrics.gauge("sd_process_peak_resident_memory_bytes", "Peak process resident memory since start")
+
+
+def current_rss() -> int:
+    """Return the process's resident memory in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Return the process's peak resident memory in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def _collect_process() -> None:
+    PROCESS_RSS.set(current_rss())
+    PROCESS_PEAK_RSS.set(peak_rss())
+
+
+metrics.on_collect(_collect_process)
+
+
+class PeakRssTracker:
+    """Samples resident memory on one background thread while any tracked block runs."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._peaks: Dict[int, int] = {}
+        self._next_token = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def track(self) -> Iterator[Dict[str, int]]:
+        """Yield a dict whose "peak" holds the highest RSS seen during the block."""
+        result = {"peak": current_rss()}
+        with self._cond:
+            token = self._next_token
+            self._next_token += 1
+            self._peaks[token] = result["peak"]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        try:
+            yield result
+        finally:
+            rss = current_rss()
+            with self._cond:
+                result["peak"] = max(self._peaks.pop(token), rss)
+
+    def _sample(self) -> None:
+        while True:
+            with self._cond:
+                while not self._peaks:
+                    self._cond.wait()
+            rss = current_rss()
+            with self._cond:
+                for token in self._peaks:
+                    self._peaks[token] = max(self._peaks[token], rss)
+            time.sleep(self.interval)
+
+
+rss_tracker = PeakRssTracker()
+
+
+@contextmanager
+def timed(stage: str, model: str = "") -> Iterator[None]:
+    """Record the enclosed block's duration as one observation of a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, model=model)
+
+
+@contextmanager
+def track_request(kind: str, model: str = "") -> Iterator[None]:
+    """Time a whole request, record its peak RSS and count its outcome."""
+    outcome = "ok"
+    try:
+        with rss_tracker.track() as rss, timed("request", model):
+            yield
+    except (Exception, GeneratorExit) as e:
+        # GeneratorExit is a streaming handler being closed, e.g. by a UI stop button
+        outcome = "cancelled" if isinstance(e, GeneratorExit) or type(e).__name__ == "GenerationCancelled" else "error"
+        FAILURES.inc(kind=kind, error=type(e).__name__)
+        raise
+    finally:
+        REQUESTS.inc(kind=kind, outcome=outcome)
+    REQUEST_PEAK_RSS.observe(rss["peak"], kind=kind)
+
+
+def call_pipeline(pipe: Any, spec: Any, **kwargs: Any) -> Any:
+    """Call a pipeline, recording seconds per denoising step and the denoise and decode stages.
+
+    Denoising is timed from the call to the last step (so it includes latent
+    preparation); decoding from the last step until the images are returned.
+    """
+    user_callback = kwargs.pop("callback_on_step_end", None)
+    state = {"start": time.perf_counter(), "last": None, "labels": None}
+
+    def callback(pipe_, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        if state["labels"] is None:
+            latents = callback_kwargs.get("latents")
+            scale = getattr(pipe_, "vae_scale_factor", 8)
+            resolution = f"{latents.shape[-1] * scale}x{latents.shape[-2] * scale}" if latents is not None else ""
+            state["labels"] = dict(model=spec.model_id, scheduler=spec.scheduler, resolution=resolution)
+        if state["last"] is not None:
+            STEP_SECONDS.observe(now - state["last"], **state["labels"])
+        state["last"] = now
+        if user_callback is not None:
+            return user_callback(pipe_, step, timestep, callback_kwargs)
+        return callback_kwargs
+
+    output = pipe(**kwargs, callback_on_step_end=callback)
+    end = time.perf_counter()
+    if state["last"] is not None:
+        STAGE_SECONDS.observe(state["last"] - state["start"], stage="denoise", model=spec.model_id)
+        STAGE_SECONDS.observe(end - state["last"], stage="decode", model=spec.model_id)
+    return output
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread, for processes without their own web app."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,141 @@
+import math
+from typing import TYPE_CHECKING, Any, List, Optional
+
+if TYPE_CHECKING:
+    import torch
+
+# Precision names to torch dtype names; torch is imported on first use
+PRECISIONS = {
+    "fp32": "float32",
+    "bf16": "bfloat16",
+    "fp16": "float16",
+}
+
+# Largest attention score matrix (batch x heads x queries x keys) computed at once in memory-bounded mode
+ATTENTION_CHUNK_BYTES = 128 * 1024 * 1024
+# VAE tile side in pixels when memory-bounded mode is always on
+DEFAULT_VAE_TILE = 512
+
+
+def get_torch_dtype(config: Any) -> "torch.dtype":
+    """Return the dtype to load weights in for the config's precision and device."""
+    import torch
+    dtype = getattr(torch, PRECISIONS.get(config.precision, "float32"))
+    # Half precision kernels are missing or slow on CPU; bf16 is the CPU fast path.
+    if dtype == torch.float16 and config.device == "cpu":
+        return torch.float32
+    return dtype
+
+
+class ChunkedAttnProcessor:
+    """Attention that processes queries in chunks once the score matrix would exceed a byte budget.
+
+    Attention memory grows with the square of the token count, so at large
+    resolutions the score matrix dominates peak memory. Keys and values are
+    projected once, then queries are attended in chunks sized to max_bytes. The
+    result matches full attention. Calls with min_tokens queries or fewer, and
+    layers this does not handle (spatial or group norms, masks, 4D inputs), use
+    the default processor.
+    """
+
+    def __init__(self, min_tokens: int = 0, max_bytes: int = ATTENTION_CHUNK_BYTES):
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        self.min_tokens = min_tokens
+        self.max_bytes = max_bytes
+        self.default = AttnProcessor2_0()
+
+    def __call__(self, attn: Any, hidden_states: "torch.Tensor", encoder_hidden_states: Optional["torch.Tensor"] = None,
+                 attention_mask: Optional["torch.Tensor"] = None, temb: Optional["torch.Tensor"] = None,
+                 scale: float = 1.0) -> "torch.Tensor":
+        import torch
+        import torch.nn.functional as F
+        if (hidden_states.ndim != 3 or attention_mask is not None or attn.spatial_norm is not None
+                or attn.group_norm is not None or attn.residual_connection):
+            return self.default(attn, hidden_states, encoder_hidden_states, attention_mask, temb, scale)
+
+        batch, tokens, _ = hidden_states.shape
+        context = hidden_states if encoder_hidden_states is None else encoder_hidden_states
+        row_bytes = batch * attn.heads * context.shape[1] * hidden_states.element_size()
+        if tokens <= self.min_tokens or tokens * row_bytes <= self.max_bytes:
+            return self.default(attn, hidden_states, encoder_hidden_states, attention_mask, temb, scale)
+
+        if encoder_hidden_states is not None and attn.norm_cross:
+            context = attn.norm_encoder_hidden_states(context)
+        query = attn.to_q(hidden_states)
+        key = attn.to_k(context)
+        value = attn.to_v(context)
+        head_dim = key.shape[-1] // attn.heads
+        query, key, value = (
+            t.view(batch, -1, attn.heads, head_dim).transpose(1, 2) for t in (query, key, value)
+        )
+
+        chunk = max(1, self.max_bytes // row_bytes)
+        out = torch.empty_like(query)
+        for start in range(0, tokens, chunk):
+            out[:, :, start:start + chunk] = F.scaled_dot_product_attention(
+                query[:, :, start:start + chunk], key, value, dropout_p=0.0, is_causal=False
+            )
+
+        hidden_states = out.transpose(1, 2).reshape(batch, -1, attn.heads * head_dim).to(query.dtype)
+        hidden_states = attn.to_out[1](attn.to_out[0](hidden_states))
+        return hidden_states / attn.rescale_output_factor
+
+
+def enable_memory_bound(pipe: Any, pixels: Optional[int] = None) -> str:
+    """Bound peak memory with tiled VAE encode/decode and query-chunked UNet attention.
+
+    With pixels set, only larger work is split: the VAE tiles images with a side
+    longer than sqrt(pixels), and attention chunks only layers with more query
+    tokens than such an image has latent pixels. Without pixels,
+    the VAE tiles anything above DEFAULT_VAE_TILE and attention chunks whenever
+    its scores would exceed ATTENTION_CHUNK_BYTES. Tiled VAE output blends
+    overlapping tiles, so it differs slightly from a single full decode.
+    """
+    tile = max(64, int(math.sqrt(pixels)) // 64 * 64) if pixels else DEFAULT_VAE_TILE
+    vae = pipe.vae
+    vae.enable_tiling()
+    vae.enable_slicing()
+    vae.tile_sample_min_size = tile
+    vae.tile_latent_min_size = tile // 2 ** (len(vae.config.block_out_channels) - 1)
+    min_tokens = pixels // pipe.vae_scale_factor ** 2 if pixels else 0
+    pipe.unet.set_attn_processor(ChunkedAttnProcessor(min_tokens=min_tokens))
+    return f"memory_bounded(vae_tile={tile}" + (f", above={pixels}px)" if pixels else ")")
+
+
+def apply_inference_profile(pipe: Any, config: Any) -> List[str]:
+    """Apply the config's inference profile to a freshly loaded pipeline.
+
+    Returns the optimizations that took effect, so callers can report them.
+    """
+    import torch
+    applied = [f"dtype={str(pipe.unet.dtype).replace('torch.', '')}"]
+    if config.precision == "fp16" and config.device == "cpu":
+        applied.append("fp16 unsupported on cpu, loaded fp32")
+
+    if config.intra_op_threads:
+        torch.set_num_threads(config.intra_op_threads)
+        applied.append(f"intra_op_threads={torch.get_num_threads()}")
+
+    if config.channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        applied.append("channels_last")
+
+    if config.attention_slicing:
+        pipe.enable_attention_slicing()
+        applied.append("attention_slicing")
+
+    # After attention slicing, whose processors it replaces on the UNet
+    if config.memory_bounded or config.memory_bounded_pixels:
+        applied.append(enable_memory_bound(pipe, None if config.memory_bounded else config.memory_bounded_pixels))
+
+    # torch.compile only wraps the UNet here; compilation, and any failure of it,
+    # happens on the first generation
+    if config.compile:
+        try:
+            pipe.unet = torch.compile(pipe.unet)
+            applied.append("compile=unet (lazy)")
+        except Exception as e:
+            applied.append(f"compile failed: {e}")
+
+    return applied
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+from image_writer import ImageWriter
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock file, every process sweeps
+    fcntl = None
+
+
+class OutputStore:
+    """Sharded store of generated images with a sidecar record per request.
+
+    Each request gets a UUID; its images are written as <id>_<n>.<ext> under
+    <root>/<id[:2]>/<id[2:4]>/ next to an <id>.json sidecar holding the
+    parameters that produced them. Records whose parameters are fully
+    deterministic (seed pinned) can be served again without regenerating:
+    <root>/keys/<key[:2]>/<key> holds the id of the record saved under a key.
+    Everything is read from disk, so every process sharing the root sees the
+    same records without scanning it at startup.
+    """
+
+    def __init__(self, root: str, writer: ImageWriter):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._swept: Dict[str, Any] = {}
+        self._sweeper_lock = None
+
+    def _shard(self, record_id: str) -> Path:
+        return Path(record_id[:2]) / record_id[2:4]
+
+    def _sidecar(self, record_id: str) -> Path:
+        return self.root / self._shard(record_id) / f"{record_id}.json"
+
+    def _key_path(self, key: str) -> Path:
+        return self.root / "keys" / key[:2] / key
+
+    def save(self, images: List[Image.Image], params: Dict[str, Any],
+             seeds: Optional[List[int]] = None, key: Optional[str] = None) -> Dict[str, Any]:
+        """Write images and record the parameters that produced them.
+
+        Encoding runs on the writer's threads; this returns once every image is in
+        place, so the record's URLs can be served right away. If a write fails,
+        whatever was written is removed and OSError is raised, leaving no record.
+        Pass the request's result key (see result_cache.result_key) when params pin
+        everything, including the seed, so an exact repeat can be served from this record.
+        """
+        record_id = uuid.uuid4().hex
+        shard = self._shard(record_id)
+        files, thumbnails, writes = [], [], []
+        for i, image in enumerate(images):
+            path, thumb, done = self.writer.submit(image, self.root / shard / f"{record_id}_{i}")
+            files.append(str(path.relative_to(self.root)))
+            if thumb is not None:
+                thumbnails.append(str(thumb.relative_to(self.root)))
+            writes.append(done)
+        record = {
+            "id": record_id,
+            "key": key,
+            "params": params,
+            "seeds": seeds,
+            "files": files,
+            "thumbnails": thumbnails,
+            "created_at": time.time(),
+        }
+        errors = [e for e in (done.exception() for done in writes) if e is not None]
+        if errors:
+            self._delete(record)
+            raise OSError(f"Could not write generated images: {errors[0]}")
+        self._write_sidecar(record)
+        if key:
+            self._write_atomic(self._key_path(key), record_id)
+        return record
+
+    def save_file(self, data: bytes, extension: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Store raw file bytes (e.g. an upload) synchronously under a new record."""
+        record_id = uuid.uuid4().hex
+        path = self.root / self._shard(record_id) / f"{record_id}_0.{extension}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        record = {
+            "id": record_id,
+            "key": None,
+            "params": params,
+            "seeds": None,
+            "files": [str(path.relative_to(self.root))],
+            "thumbnails": [],
+            "created_at": time.time(),
+        }
+        self._write_sidecar(record)
+        return record
+
+    def _write_sidecar(self, record: Dict[str, Any]) -> None:
+        self._write_atomic(self._sidecar(record["id"]), json.dumps(record))
+
+    def _write_atomic(self, path: Path, text: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.write_text(text)
+        os.replace(tmp_path, path)
+
+    def _read_record(self, record_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._sidecar(record_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the deterministic record stored under a key, if its sidecar and images are still on disk."""
+        try:
+            record_id = self._key_path(key).read_text().strip()
+        except OSError:
+            return None
+        record = self._read_record(record_id)
+        if record and all(path.exists() for path in self._record_paths(record)):
+            return record
+        return None
+
+    def _record_paths(self, record: Dict[str, Any]) -> List[Path]:
+        names = record["files"] + record.get("thumbnails", [])
+        return [self.root / name for name in names] + [self._sidecar(record["id"])]
+
+    def _delete(self, record: Dict[str, Any]) -> None:
+        # The key goes first, so lookups stop finding the record before its files go
+        key = record.get("key")
+        if key:
+            key_path = self._key_path(key)
+            try:
+                if key_path.read_text().strip() == record["id"]:
+                    key_path.unlink()
+            except FileNotFoundError:
+                pass
+        for path in self._record_paths(record):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _scan(self) -> Dict[str, Dict[str, float]]:
+        """Size and sidecar time of every record on disk, from one stat per file.
+
+        Records whose sidecar is not written yet are still being saved and are left
+        out. Files another process deletes mid-scan are skipped.
+        """
+        found: Dict[str, Dict[str, float]] = {}
+        for path in self.root.glob("??/??/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entry = found.setdefault(path.name[:32], {"size": 0, "created_at": None})
+            entry["size"] += stat.st_size
+            if path.name.endswith(".json"):
+                entry["created_at"] = stat.st_mtime
+        return {record_id: entry for record_id, entry in found.items() if entry["created_at"] is not None}
+
+    def sweep(self, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> int:
+        """Delete the oldest records beyond an age (seconds) or total size limit; return how many."""
+        records = self._scan()
+        total = sum(entry["size"] for entry in records.values())
+        cutoff = time.time() - max_age if max_age is not None else None
+        deleted = 0
+        for record_id, entry in sorted(records.items(), key=lambda item: item[1]["created_at"]):
+            expired = cutoff is not None and entry["created_at"] < cutoff
+            oversize = max_bytes is not None and total > max_bytes
+            if not (expired or oversize):
+                break
+            record = self._read_record(record_id)
+            if record is not None:
+                self._delete(record)
+            total -= entry["size"]
+            deleted += 1
+        with self._lock:
+            self._swept = {"records": len(records) - deleted, "bytes": total, "swept_at": time.time()}
+        return deleted
+
+    def _hold_sweeper_lock(self) -> bool:
+        """Take the store's sweeper lock file, so one process sweeps a shared root."""
+        if fcntl is None or self._sweeper_lock is not None:
+            return True
+        lock_file = open(self.root / ".sweeper.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held until the process exits; another process takes over from there
+        self._sweeper_lock = lock_file
+        return True
+
+    def start_sweeper(self, interval: float, max_bytes: Optional[int] = None,
+                      max_age: Optional[float] = None) -> threading.Thread:
+        """Run sweep() every interval seconds on a daemon thread, in whichever process holds the sweeper lock."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if not self._hold_sweeper_lock():
+                    continue
+                try:
+                    self.sweep(max_bytes, max_age)
+                except Exception as e:
+                    print(f"Output store sweep failed: {e}")
+
+        thread = threading.Thread(target=loop, name="output-store-sweeper", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        """Record count and size as of this process's last sweep (empty if it has not swept)."""
+        with self._lock:
+            return dict(self._swept, sweeper=self._sweeper_lock is not None)
@@ -0,0 +1,123 @@
+import inspect
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.model_config import get_scheduler_class
+from optimizations import apply_inference_profile, get_torch_dtype
+from pipeline_registry import registry
+from metrics import timed
+from weight_loading import load_pipeline, weight_cache_dir
+
+# Diffusers pipeline class names per kind, as (standard, SDXL); imported on first use
+PIPELINE_CLASSES = {
+    "text2img": ("StableDiffusionPipeline", "StableDiffusionXLPipeline"),
+    "img2img": ("StableDiffusionImg2ImgPipeline", "StableDiffusionXLImg2ImgPipeline"),
+    "inpaint": ("StableDiffusionInpaintPipeline", "StableDiffusionXLInpaintPipeline"),
+}
+
+# Modules an SDXL refiner takes from its base model instead of loading its own copies
+REFINER_SHARED_COMPONENTS = ("text_encoder_2", "vae")
+
+
+def is_xl_model(model_id: str) -> bool:
+    """Whether a model id names an SDXL model (base or refiner)."""
+    return "xl" in model_id.lower()
+
+
+def get_pipeline_class(kind: str, is_xl: bool) -> Any:
+    """Return the diffusers pipeline class for a kind and model family."""
+    import diffusers
+    return getattr(diffusers, PIPELINE_CLASSES[kind][int(is_xl)])
+
+
+class PipelineFamily:
+    """One set of loaded model components shared by the text2img, img2img and inpaint pipelines."""
+
+    def __init__(self, base: Any, is_xl: bool, optimizations: List[str] = None):
+        self.base = base
+        self.is_xl = is_xl
+        self.optimizations = optimizations or []
+        self.load_info: Dict[str, Any] = {}
+        self.default_scheduler_class = type(base.scheduler)
+        self.scheduler_config = base.scheduler.config
+        self._variants: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, config: Any, shared: Optional[Dict[str, Any]] = None) -> "PipelineFamily":
+        """Load the model components once, apply the inference profile and wrap them in a family.
+
+        Modules in shared are another family's, used instead of loading this model's own.
+        """
+        is_xl = is_xl_model(config.model_id)
+        # The SDXL refiner ships without the first text encoder, so it loads as img2img.
+        base_kind = "img2img" if is_xl and "refiner" in config.model_id.lower() else "text2img"
+        base_class = get_pipeline_class(base_kind, is_xl)
+        with timed("pipeline_load", config.model_id):
+            base = load_pipeline(base_class, config.model_id, get_torch_dtype(config), weight_cache_dir(), shared)
+            base = base.to(config.device)
+        family = cls(base, is_xl, apply_inference_profile(base, config))
+        family.load_info = base.load_info
+        family._variants[base_kind] = base
+        return family
+
+    @property
+    def components(self) -> Dict[str, Any]:
+        return self.base.components
+
+    def _derive(self, pipeline_class: Any, source: Any = None, **overrides: Any) -> Any:
+        """Build a pipeline of another class around the already-loaded components."""
+        source = source if source is not None else self.base
+        params = inspect.signature(pipeline_class.__init__).parameters
+        kwargs = {name: module for name, module in source.components.items() if name in params}
+        for name in params:
+            if name not in kwargs and name in source.config:
+                kwargs[name] = source.config[name]
+        kwargs.update(overrides)
+        return pipeline_class(**kwargs)
+
+    def get(self, kind: str) -> Any:
+        """Return the shared pipeline for kind, deriving it from the components on first use."""
+        with self._lock:
+            if kind not in self._variants:
+                self._variants[kind] = self._derive(get_pipeline_class(kind, self.is_xl))
+            return self._variants[kind]
+
+    def make_scheduler(self, scheduler_name: str = "default") -> Any:
+        """Create a fresh scheduler instance from the cached scheduler config."""
+        scheduler_class = get_scheduler_class(scheduler_name) or self.default_scheduler_class
+        return scheduler_class.from_config(self.scheduler_config)
+
+    def pipeline(self, kind: str, scheduler_name: str = "default") -> Any:
+        """Return a per-request pipeline for kind with its own scheduler instance.
+
+        Schedulers keep per-run state (timesteps, step index), so every request gets
+        its own instance while the weights stay shared with the cached pipelines.
+        """
+        template = self.get(kind)
+        return self._derive(type(template), template, scheduler=self.make_scheduler(scheduler_name))
+
+
+def family_key(config: Any) -> Tuple:
+    """Registry key of a config's model and inference profile."""
+    return (config.model_id, config.device, str(get_torch_dtype(config)),
+            config.channels_last, config.compile, config.attention_slicing,
+            config.memory_bounded, config.memory_bounded_pixels)
+
+
+def get_pipeline_family(config: Any) -> PipelineFamily:
+    """Return the cached pipeline family for a config's model and profile, loading it on first use."""
+    return registry.get(family_key(config), lambda: PipelineFamily.load(config))
+
+
+def get_refiner_family(config: Any, base_config: Any) -> PipelineFamily:
+    """Return the cached SDXL refiner family that shares its text encoder and VAE with a base model's family.
+
+    It is cached separately from a standalone refiner, under the base's key as well.
+    The registry counts the shared modules in both entries' sizes.
+    """
+    base = get_pipeline_family(base_config)
+    shared = {name: base.components[name] for name in REFINER_SHARED_COMPONENTS
+              if base.components.get(name) is not None}
+    key = family_key(config) + ("refiner_of",) + family_key(base_config)
+    return registry.get(key, lambda: PipelineFamily.load(config, shared))
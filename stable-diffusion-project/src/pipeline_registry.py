@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import metrics
+
+
+def estimate_pipeline_bytes(pipe: Any) -> int:
+    """Estimate the resident size of a pipeline or family from its module parameters and buffers."""
+    import torch
+    seen = set()
+    total = 0
+    for component in getattr(pipe, "components", {}).values():
+        if not isinstance(component, torch.nn.Module):
+            continue
+        for tensor in list(component.parameters()) + list(component.buffers()):
+            if tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class PipelineRegistry:
+    """Process-wide LRU cache of loaded pipeline families with a memory budget."""
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached entry for key, calling loader on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given key; the others wait and then hit.
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+                self.misses += 1
+
+            start = time.perf_counter()
+            pipe = loader()
+            elapsed = time.perf_counter() - start
+            size = estimate_pipeline_bytes(pipe)
+
+            with self._lock:
+                self.load_seconds += elapsed
+                self._entries[key] = pipe
+                self._sizes[key] = size
+                self._evict()
+                self._key_locks.pop(key, None)
+            return pipe
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the budget is met (lock held)."""
+        if self.max_bytes is None:
+            return
+        # Always keep the most recent entry, even if it alone exceeds the budget.
+        while len(self._entries) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            self._sizes.pop(key, None)
+            self.evictions += 1
+
+    def set_budget(self, max_bytes: Optional[int]) -> None:
+        """Change the memory budget and evict down to it."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/load-time counters and current occupancy."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_seconds": round(self.load_seconds, 3),
+                "entries": len(self._entries),
+                "bytes": sum(self._sizes.values()),
+                "max_bytes": self.max_bytes,
+                "cached": [
+                    {
+                        "key": list(map(str, key)),
+                        "bytes": self._sizes.get(key, 0),
+                        "optimizations": getattr(entry, "optimizations", []),
+                        "load": getattr(entry, "load_info", {}),
+                    }
+                    for key, entry in self._entries.items()
+                ],
+            }
+
+
+def _budget_from_env() -> Optional[int]:
+    """Read the registry budget in megabytes from SD_PIPELINE_CACHE_MB."""
+    value = os.environ.get("SD_PIPELINE_CACHE_MB")
+    return int(value) * 1024 * 1024 if value else None
+
+
+registry = PipelineRegistry(max_bytes=_budget_from_env())
+metrics.export_stats("sd_pipeline_cache", registry.stats)
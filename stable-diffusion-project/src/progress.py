@@ -0,0 +1,106 @@
+import base64
+import io
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from PIL import Image
+
+# Linear maps from the four latent channels to RGB, a cheap stand-in for a VAE decode
+LATENT_RGB_FACTORS = {
+    "sd": ([[0.298, 0.207, 0.208], [0.187, 0.286, 0.173], [-0.158, 0.189, 0.264], [-0.184, -0.271, -0.473]],
+           [0.0, 0.0, 0.0]),
+    "sdxl": ([[0.3651, 0.4232, 0.4341], [-0.2533, -0.0042, 0.1068], [0.1076, 0.1111, -0.0362], [-0.3165, -0.2492, -0.2188]],
+             [0.1084, -0.0175, -0.0011]),
+}
+
+
+class GenerationCancelled(Exception):
+    """Raised from a step callback to abort the denoising loop."""
+
+
+def latent_preview(latents: Any, is_xl: bool = False) -> Image.Image:
+    """Approximate the first image of a latent batch at 1/8 resolution without running the VAE."""
+    import torch
+    factors, bias = LATENT_RGB_FACTORS["sdxl" if is_xl else "sd"]
+    with torch.no_grad():
+        latent = latents[0].float().cpu()
+        rgb = torch.einsum("chw,cr->hwr", latent, torch.tensor(factors)) + torch.tensor(bias)
+        rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().numpy()
+    return Image.fromarray(rgb)
+
+
+def preview_data_url(image: Image.Image, quality: int = 70) -> str:
+    """Encode a preview as a small JPEG data URL for clients."""
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+class StepProgress:
+    """Step state for one request, updated by the pipeline step callback.
+
+    The callback raises GenerationCancelled at the next step once cancel() is
+    called (or is_cancelled returns True), which aborts the denoising loop. With
+    preview_every set, a latent preview is refreshed every that many steps.
+    """
+
+    def __init__(
+        self,
+        preview_every: int = 0,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        on_step: Optional[Callable[["StepProgress"], None]] = None
+    ):
+        self.preview_every = preview_every
+        self.is_cancelled = is_cancelled
+        self.on_step = on_step
+        self.step = 0
+        self.total_steps: Optional[int] = None
+        self.preview: Optional[Image.Image] = None
+        self.preview_step = 0
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or bool(self.is_cancelled and self.is_cancelled())
+
+    @property
+    def fraction(self) -> float:
+        return self.step / self.total_steps if self.total_steps else 0.0
+
+    def callback(self, pipe: Any, step: int, timestep: Any, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Pipeline callback_on_step_end hook."""
+        if self.cancelled:
+            raise GenerationCancelled("Generation was cancelled")
+        self.step = step + 1
+        self.total_steps = getattr(pipe, "num_timesteps", None) or self.total_steps
+        if self.preview_every and self.step % self.preview_every == 0 and "latents" in callback_kwargs:
+            self.preview = latent_preview(callback_kwargs["latents"], "XL" in type(pipe).__name__)
+            self.preview_step = self.step
+        if self.on_step is not None:
+            self.on_step(self)
+        return callback_kwargs
+
+
+class StageView:
+    """A pipeline seen by step callbacks as one stage of a longer run, reporting the run's total steps."""
+
+    def __init__(self, pipe: Any, total_steps: int):
+        self._pipe = pipe
+        self.num_timesteps = total_steps
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pipe, name)
+
+
+def stage_callback(callback: Optional[Callable], offset: int, total_steps: int) -> Optional[Callable]:
+    """Adapt a step callback to a stage that starts offset steps into a run of total_steps."""
+    if callback is None:
+        return None
+
+    def on_step(pipe: Any, step: int, timestep: Any, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return callback(StageView(pipe, total_steps), offset + step, timestep, callback_kwargs)
+
+    return on_step
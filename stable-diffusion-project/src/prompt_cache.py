@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from metrics import metrics, timed
+
+if TYPE_CHECKING:
+    import torch
+
+# Keyword names of the precomputed embeddings, in encode_prompt return order
+EMBEDDING_NAMES = (
+    "prompt_embeds",
+    "negative_prompt_embeds",
+    "pooled_prompt_embeds",
+    "negative_pooled_prompt_embeds",
+)
+
+
+class PromptEmbeddingCache:
+    """Bounded LRU cache of text encoder outputs keyed by model and prompt pair."""
+
+    def __init__(self, max_bytes: Optional[int] = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[torch.Tensor, ...]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(tensors: Tuple["torch.Tensor", ...]) -> int:
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _encode(self, pipe: Any, prompt: str, negative_prompt: str) -> Tuple["torch.Tensor", ...]:
+        """Run the pipeline's text encoder(s) for one prompt pair."""
+        import torch
+        with torch.no_grad():
+            return tuple(pipe.encode_prompt(
+                prompt=prompt,
+                device=pipe.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=True,
+                negative_prompt=negative_prompt
+            ))
+
+    def get(self, pipe: Any, model_id: str, prompt: str, negative_prompt: str) -> Tuple["torch.Tensor", ...]:
+        """Return the embeddings for one prompt pair, encoding them on a miss."""
+        key = (model_id, str(pipe.dtype), prompt, negative_prompt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        with timed("text_encode", model_id):
+            tensors = self._encode(pipe, prompt, negative_prompt)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = tensors
+                self._bytes += self._size(tensors)
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+        return tensors
+
+    def embeddings(self, pipe: Any, model_id: str, prompts: List[str],
+                   negative_prompts: List[str]) -> Dict[str, "torch.Tensor"]:
+        """Return pipeline keyword arguments with precomputed embeddings for a batch of prompt pairs."""
+        import torch
+        rows = [self.get(pipe, model_id, p, n) for p, n in zip(prompts, negative_prompts)]
+        return {
+            name: torch.cat([row[i] for row in rows])
+            for i, name in enumerate(EMBEDDING_NAMES[:len(rows[0])])
+        }
+
+    def clear(self) -> None:
+        """Drop every cached embedding."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate and memory use."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _budget_from_env() -> Optional[int]:
+    """Read the cache budget in megabytes from SD_PROMPT_CACHE_MB."""
+    return int(os.environ.get("SD_PROMPT_CACHE_MB", 128)) * 1024 * 1024
+
+
+prompt_cache = PromptEmbeddingCache(max_bytes=_budget_from_env())
+metrics.export_stats("sd_prompt_cache", prompt_cache.stats)
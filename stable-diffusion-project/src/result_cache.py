@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from PIL import Image
+from utils import canonical_digest
+
+
+@dataclass
+class CachedResult:
+    images: List[Image.Image]
+    seeds: List[int]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(image.width * image.height * len(image.getbands()) for image in self.images)
+
+
+def image_digest(image: Union[Image.Image, bytes]) -> str:
+    """Hash an input image's bytes (raw upload bytes or decoded pixels)."""
+    if isinstance(image, Image.Image):
+        header = f"{image.mode}:{image.width}x{image.height}:".encode()
+        return hashlib.sha256(header + image.tobytes()).hexdigest()
+    return hashlib.sha256(image).hexdigest()
+
+
+def result_key(params: Dict[str, Any], *images: Union[Image.Image, bytes, None]) -> str:
+    """Canonical key of a full generation spec, including the hashes of any input images."""
+    digests = [image_digest(image) for image in images if image is not None]
+    return canonical_digest(dict(params, input_images=digests))
+
+
+class MemoryBackend:
+    """In-process LRU of results bounded by decoded image bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: str, result: CachedResult) -> None:
+        if key in self._entries or result.nbytes > self.max_bytes:
+            return
+        self._entries[key] = result
+        self._bytes += result.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class DiskBackend:
+    """On-disk results, one directory of PNGs per key, evicted least recently used first."""
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        meta_path = self._dir(key) / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text())
+            images = []
+            for i in range(len(meta["seeds"])):
+                with Image.open(self._dir(key) / f"{i}.png") as image:
+                    images.append(image.copy())
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(meta_path)  # mark as recently used for eviction
+        return CachedResult(images, meta["seeds"])
+
+    def put(self, key: str, result: CachedResult) -> None:
+        target = self._dir(key)
+        if target.exists():
+            return
+        tmp_dir = target.with_name(f".{key}.tmp")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for i, image in enumerate(result.images):
+            image.save(tmp_dir / f"{i}.png", compress_level=1)
+        (tmp_dir / "meta.json").write_text(json.dumps({"seeds": result.seeds, "created_at": time.time()}))
+        try:
+            os.replace(tmp_dir, target)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self._evict()
+
+    def _entries(self) -> List[Path]:
+        return [meta.parent for meta in self.root.glob("*/*/meta.json")]
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        sizes = {entry: sum(f.stat().st_size for f in entry.iterdir()) for entry in entries}
+        total = sum(sizes.values())
+        for entry in sorted(entries, key=lambda e: (e / "meta.json").stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "disk", "root": str(self.root), "entries": len(self._entries()), "max_bytes": self.max_bytes}
+
+
+class StoreBackend:
+    """Serves deterministic records already kept by an OutputStore.
+
+    Records are indexed when OutputStore.save() is given the result key, so
+    put() has nothing to do; the store's retention sweeper bounds its size.
+    """
+
+    def __init__(self, store: Any):
+        self.store = store
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(key)
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.store.stats(), backend="store")
+
+
+class ResultCache:
+    """Serves identical seeded generation requests without re-running diffusion.
+
+    Only requests whose spec pins the seed are deterministic; callers should
+    skip the cache otherwise. The backend decides what a cached value is and
+    how much may be kept.
+    """
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self.backend.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.backend.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                self.backend.stats(),
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=round(self.hits / lookups, 3) if lookups else None
+            )
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    """Build the result cache selected by SD_RESULT_CACHE (memory, disk or off)."""
+    kind = os.environ.get("SD_RESULT_CACHE", "memory")
+    max_bytes = int(os.environ.get("SD_RESULT_CACHE_MB", 256)) * 1024 * 1024
+    if kind == "memory":
+        return ResultCache(MemoryBackend(max_bytes))
+    if kind == "disk":
+        return ResultCache(DiskBackend(os.environ.get("SD_RESULT_CACHE_DIR", "cache/results"), max_bytes))
+    return None
@@ -0,0 +1,28 @@
+import random
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    import torch
+
+
+def resolve_seeds(seed: Optional[int], count: int) -> List[int]:
+    """Return one effective seed per image.
+
+    A pinned seed gives images seed, seed + 1, ..., so any single image can be
+    regenerated alone by requesting its own seed with one image. Without a seed,
+    each image gets an independent random seed. Seeds are cast to int, since UI
+    number fields may deliver them as floats.
+    """
+    if seed is None:
+        return [random.randrange(2**32) for _ in range(count)]
+    return [int(seed) + i for i in range(count)]
+
+
+def make_generators(seeds: List[int]) -> List["torch.Generator"]:
+    """Build one seeded generator per image.
+
+    Generators live on the CPU so the same seed reproduces the same initial
+    noise whatever device the pipeline runs on.
+    """
+    import torch
+    return [torch.Generator(device="cpu").manual_seed(int(seed)) for seed in seeds]
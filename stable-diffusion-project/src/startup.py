@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+
+class StartupTimer:
+    """Records how long each named startup phase took."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._phases: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._phases[name] = round(seconds, 3)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as one phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phases": dict(self._phases),
+                "uptime": round(time.time() - self.started_at, 3),
+            }
+
+
+class Prewarmer:
+    """Loads a list of models on a background thread so the first requests find them warm.
+
+    Each model moves from "cold" to "loading" to "warm" (or "failed"). The
+    process is ready once no model is still cold or loading and at least one is
+    warm; it is degraded while any model has failed.
+    """
+
+    def __init__(self, specs: Dict[str, Any], timer: Optional[StartupTimer] = None):
+        self.specs = specs
+        self.timer = timer or StartupTimer()
+        self._states = {name: {"state": "cold"} for name in specs}
+        self._lock = threading.Lock()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._run, name="prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def _set(self, name: str, **state: Any) -> None:
+        with self._lock:
+            self._states[name] = state
+
+    def _run(self) -> None:
+        if not self.specs:
+            return
+        # The heavy imports are deferred until here, off the serving path. If they
+        # fail, no model can load, so every one is marked failed rather than left cold
+        try:
+            with self.timer.phase("import_diffusers"):
+                import torch  # noqa: F401
+                import diffusers  # noqa: F401
+                from pipeline_family import get_pipeline_family
+        except Exception as e:
+            for name in self.specs:
+                self._set(name, state="failed", error=str(e))
+            print(f"Prewarm failed, could not import the model libraries: {e}")
+            return
+
+        for name, spec in self.specs.items():
+            self._set(name, state="loading")
+            start = time.perf_counter()
+            try:
+                with self.timer.phase(f"load:{name}"):
+                    get_pipeline_family(spec)
+            except Exception as e:
+                self._set(name, state="failed", error=str(e))
+                print(f"Prewarm of {name} failed: {e}")
+                continue
+            self._set(name, state="warm", seconds=round(time.perf_counter() - start, 3))
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {name: dict(state) for name, state in self._states.items()}
+        states = [m["state"] for m in models.values()]
+        settled = all(state in ("warm", "failed") for state in states)
+        # A process whose every model failed can serve nothing, so it never reports ready
+        return {
+            "ready": settled and (not states or "warm" in states),
+            "degraded": "failed" in states,
+            "models": models,
+            "startup": self.timer.report(),
+        }
@@ -1,8 +1,12 @@
+import hashlib
+import json
 import os
+import uuid
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict
 
-def get_output_path(image_type: str, index: int = None) -> str:
+def get_output_path(image_type: str, index: int = None, extension: str = "png") -> str:
     """Generate output path for the generated image."""
     # Create assets directory if it doesn't exist
     assets_dir = Path("assets")
@@ -12,11 +16,16 @@ def get_output_path(image_type: str, index: int = None) -> str:
     type_dir = assets_dir / image_type
     type_dir.mkdir(exist_ok=True)
     
-    # Generate filename with timestamp and optional index
+    # Generate filename with timestamp, a unique suffix and optional index
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{image_type}_{timestamp}"
+    filename = f"{image_type}_{timestamp}_{uuid.uuid4().hex[:8]}"
     if index is not None:
         filename += f"_{index}"
-    filename += ".png"
+    filename += f".{extension}"
     
-    return str(type_dir / filename)
\ No newline at end of file
+    return str(type_dir / filename)
+
+def canonical_digest(params: Dict[str, Any]) -> str:
+    """Return a stable hash of generation parameters, independent of key order."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -1,16 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
 import gradio as gr
-import torch
 from PIL import Image
-import numpy as np
 from config.config_manager import ConfigManager
-from config.model_config import ModelConfig, DEFAULT_CONFIGS
-from generate import get_pipeline
-from advanced_generation import generate_img2img, generate_inpaint, prepare_image
+from config.model_config import DEFAULT_CONFIGS, model_overrides, model_size
+from batching import MicroBatcher
+from seeding import resolve_seeds
+from dataclasses import asdict
+from result_cache import CachedResult, create_result_cache, result_key
+from progress import StepProgress
+from advanced_generation import generate_img2img, generate_inpaint
+from image_input import prepare_image
+from metrics import metrics, start_metrics_server, track_request
 
-# Initialize configuration
+# Initialize configuration; handlers derive immutable per-request specs from these defaults
 config_manager = ConfigManager()
 config = config_manager.load_config()
 
+# Concurrent compatible text-to-image requests share one pipeline call
+batcher = MicroBatcher()
+
+# Exact repeats of seeded requests are served without running diffusion (SD_RESULT_CACHE)
+result_cache = create_result_cache()
+
+# img2img and inpainting run here so handlers can stream their progress; sized like the queue
+executor = ThreadPoolExecutor(max_workers=4)
+
+# Latent previews are shown every this many steps (0 disables them)
+PREVIEW_EVERY = int(os.environ.get("SD_PREVIEW_EVERY", 5))
+
+# Prometheus metrics are served on their own port when SD_METRICS_PORT is set
+METRICS_PORT = int(os.environ.get("SD_METRICS_PORT", 0))
+metrics.export_stats("sd_batcher", batcher.stats, counters=("batches", "requests"))
+if result_cache:
+    metrics.export_stats("sd_result_cache", result_cache.stats)
+
+def with_seed_captions(images, seeds, cached=False):
+    """Pair each image with its effective seed for the gallery."""
+    suffix = " (cached)" if cached else ""
+    return [(image, f"Seed: {seed}{suffix}") for image, seed in zip(images, seeds)]
+
+def cached_generate(spec, params, start, report, *input_images):
+    """Serve a seeded request from the result cache, or run it and stream its progress.
+
+    start(seeds, callback) begins the run and returns a future of its images. While it
+    runs, step previews are yielded to the gallery; if the event is cancelled (Stop),
+    the run aborts at its next step.
+    """
+    with track_request(params["kind"], spec.model_id):
+        key = result_key(dict(asdict(spec), **params), *input_images) if result_cache and spec.seed is not None else None
+        cached = result_cache.get(key) if key else None
+        if cached is not None:
+            yield with_seed_captions(cached.images, cached.seeds, cached=True)
+            return
+
+        seeds = resolve_seeds(spec.seed, spec.num_images)
+        progress = StepProgress(preview_every=PREVIEW_EVERY)
+        future = start(seeds, progress.callback)
+        shown = 0
+        try:
+            while not future.done():
+                wait([future], timeout=0.25)
+                report(progress.fraction, desc=f"Step {progress.step}/{progress.total_steps or spec.num_inference_steps}")
+                if progress.preview is not None and progress.preview_step != shown:
+                    shown = progress.preview_step
+                    yield [(progress.preview, f"Step {progress.step}")]
+            images = future.result()
+        finally:
+            if not future.done():
+                progress.cancel()
+                future.cancel()
+        if key:
+            result_cache.put(key, CachedResult(images, seeds))
+        yield with_seed_captions(images, seeds)
+
 def text2img(
     prompt: str,
     negative_prompt: str,
@@ -21,33 +84,29 @@ def text2img(
     width: int,
     height: int,
     num_images: int,
-    seed: int
+    seed: int,
+    progress=gr.Progress()
 ):
     """Text to image generation interface."""
-    # Update config
-    config.model_id = DEFAULT_CONFIGS[model_name].model_id
-    config.scheduler = scheduler
-    config.num_inference_steps = steps
-    config.guidance_scale = guidance
-    config.width = width
-    config.height = height
-    config.num_images = num_images
-    config.seed = seed if seed > 0 else None
-    config.negative_prompt = negative_prompt
-
-    # Generate images
-    pipe = get_pipeline(config)
-    images = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
+    spec = config.to_spec(
+        **model_overrides(model_name),
+        scheduler=scheduler,
         num_inference_steps=steps,
         guidance_scale=guidance,
         width=width,
         height=height,
-        num_images_per_prompt=num_images
-    ).images
+        num_images=num_images,
+        seed=int(seed) if seed > 0 else None,
+        negative_prompt=negative_prompt
+    )
 
-    return images
+    # Generate images
+    yield from cached_generate(
+        spec,
+        {"kind": "text2img", "prompt": prompt},
+        lambda seeds, callback: batcher.submit(spec, prompt, seeds=seeds, callback=callback),
+        progress
+    )
 
 def img2img(
     init_image: Image.Image,
@@ -59,28 +118,40 @@ def img2img(
     guidance: float,
     strength: float,
     num_images: int,
-    seed: int
+    seed: int,
+    progress=gr.Progress()
 ):
     """Image to image generation interface."""
-    # Update config
-    config.model_id = DEFAULT_CONFIGS[model_name].model_id
-    config.scheduler = scheduler
-    config.num_inference_steps = steps
-    config.guidance_scale = guidance
-    config.num_images = num_images
-    config.seed = seed if seed > 0 else None
-    config.negative_prompt = negative_prompt
+    spec = config.to_spec(
+        **model_overrides(model_name),
+        **model_size(model_name, config),
+        scheduler=scheduler,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
+        num_images=num_images,
+        seed=int(seed) if seed > 0 else None,
+        negative_prompt=negative_prompt
+    )
+    # Inputs are downscaled to the model's output area before encoding
+    init_image = prepare_image(init_image, max_pixels=spec.width * spec.height)
 
     # Generate images
-    images = generate_img2img(
-        config=config,
-        init_image=init_image,
-        prompt=prompt,
-        strength=strength
+    yield from cached_generate(
+        spec,
+        {"kind": "img2img", "prompt": prompt, "strength": strength},
+        lambda seeds, callback: executor.submit(
+            generate_img2img,
+            config=spec,
+            init_image=init_image,
+            prompt=prompt,
+            strength=strength,
+            callback_on_step_end=callback,
+            seeds=seeds
+        ),
+        progress,
+        init_image
     )
 
-    return images
-
 def inpaint(
     init_image: Image.Image,
     mask_image: Image.Image,
@@ -91,28 +162,42 @@ def inpaint(
     steps: int,
     guidance: float,
     num_images: int,
-    seed: int
+    seed: int,
+    progress=gr.Progress()
 ):
     """Inpainting interface."""
-    # Update config
-    config.model_id = DEFAULT_CONFIGS[model_name].model_id
-    config.scheduler = scheduler
-    config.num_inference_steps = steps
-    config.guidance_scale = guidance
-    config.num_images = num_images
-    config.seed = seed if seed > 0 else None
-    config.negative_prompt = negative_prompt
+    spec = config.to_spec(
+        **model_overrides(model_name),
+        **model_size(model_name, config),
+        scheduler=scheduler,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
+        num_images=num_images,
+        seed=int(seed) if seed > 0 else None,
+        negative_prompt=negative_prompt
+    )
+    # Inputs are downscaled to the model's output area before encoding; the mask follows the image
+    init_image = prepare_image(init_image, max_pixels=spec.width * spec.height)
+    mask_image = prepare_image(mask_image, target_size=init_image.size)
 
     # Generate images
-    images = generate_inpaint(
-        config=config,
-        init_image=init_image,
-        mask_image=mask_image,
-        prompt=prompt
+    yield from cached_generate(
+        spec,
+        {"kind": "inpaint", "prompt": prompt},
+        lambda seeds, callback: executor.submit(
+            generate_inpaint,
+            config=spec,
+            init_image=init_image,
+            mask_image=mask_image,
+            prompt=prompt,
+            callback_on_step_end=callback,
+            seeds=seeds
+        ),
+        progress,
+        init_image,
+        mask_image
     )
 
-    return images
-
 def create_interface():
     """Create the Gradio interface."""
     with gr.Blocks(title="Stable Diffusion Web UI") as interface:
@@ -142,12 +227,14 @@ def create_interface():
                             height = gr.Slider(256, 1024, value=512, step=64, label="Height")
                         with gr.Row():
                             num_images = gr.Slider(1, 4, value=1, step=1, label="Number of Images")
-                            seed = gr.Number(value=-1, label="Seed (-1 for random)")
-                        generate_btn = gr.Button("Generate")
+                            seed = gr.Number(value=-1, precision=0, label="Seed (-1 for random)")
+                        with gr.Row():
+                            generate_btn = gr.Button("Generate")
+                            stop_btn = gr.Button("Stop")
                     with gr.Column():
                         output_gallery = gr.Gallery(label="Generated Images")
                 
-                generate_btn.click(
+                generate_event = generate_btn.click(
                     fn=text2img,
                     inputs=[
                         prompt, negative_prompt, model_name, scheduler,
@@ -155,6 +242,7 @@ def create_interface():
                     ],
                     outputs=output_gallery
                 )
+                stop_btn.click(fn=None, cancels=[generate_event])
 
             with gr.TabItem("Image to Image"):
                 with gr.Row():
@@ -178,12 +266,14 @@ def create_interface():
                         strength = gr.Slider(0.0, 1.0, value=0.75, label="Strength")
                         with gr.Row():
                             num_images = gr.Slider(1, 4, value=1, step=1, label="Number of Images")
-                            seed = gr.Number(value=-1, label="Seed (-1 for random)")
-                        generate_btn = gr.Button("Generate")
+                            seed = gr.Number(value=-1, precision=0, label="Seed (-1 for random)")
+                        with gr.Row():
+                            generate_btn = gr.Button("Generate")
+                            stop_btn = gr.Button("Stop")
                     with gr.Column():
                         output_gallery = gr.Gallery(label="Generated Images")
                 
-                generate_btn.click(
+                generate_event = generate_btn.click(
                     fn=img2img,
                     inputs=[
                         init_image, prompt, negative_prompt, model_name, scheduler,
@@ -191,6 +281,7 @@ def create_interface():
                     ],
                     outputs=output_gallery
                 )
+                stop_btn.click(fn=None, cancels=[generate_event])
 
             with gr.TabItem("Inpainting"):
                 with gr.Row():
@@ -214,12 +305,14 @@ def create_interface():
                             guidance = gr.Slider(1.0, 20.0, value=7.5, label="Guidance Scale")
                         with gr.Row():
                             num_images = gr.Slider(1, 4, value=1, step=1, label="Number of Images")
-                            seed = gr.Number(value=-1, label="Seed (-1 for random)")
-                        generate_btn = gr.Button("Generate")
+                            seed = gr.Number(value=-1, precision=0, label="Seed (-1 for random)")
+                        with gr.Row():
+                            generate_btn = gr.Button("Generate")
+                            stop_btn = gr.Button("Stop")
                     with gr.Column():
                         output_gallery = gr.Gallery(label="Generated Images")
                 
-                generate_btn.click(
+                generate_event = generate_btn.click(
                     fn=inpaint,
                     inputs=[
                         init_image, mask_image, prompt, negative_prompt, model_name, scheduler,
@@ -227,9 +320,14 @@ def create_interface():
                     ],
                     outputs=output_gallery
                 )
+                stop_btn.click(fn=None, cancels=[generate_event])
 
     return interface
 
 if __name__ == "__main__":
     interface = create_interface()
+    interface.queue(default_concurrency_limit=4)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+        print(f"Metrics available at http://localhost:{METRICS_PORT}/metrics")
     interface.launch(share=True) 
\ No newline at end of file
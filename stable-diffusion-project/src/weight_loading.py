@@ -0,0 +1,198 @@
+import importlib
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from metrics import metrics, rss_tracker
+
+if TYPE_CHECKING:
+    import torch
+
+# safetensors dtype codes to torch dtype names
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+# Weight file names per library; sharded and variant checkpoints load through from_pretrained
+WEIGHT_FILES = {
+    "diffusers": "diffusion_pytorch_model.safetensors",
+    "transformers": "model.safetensors",
+}
+
+LOAD_PEAK_RSS = metrics.gauge(
+    "sd_pipeline_load_peak_rss_bytes", "Peak process resident memory during the last load of a model", ["model", "source"])
+
+
+def load_mmap_state_dict(path: Path) -> Dict[str, "torch.Tensor"]:
+    """Map a safetensors file and return tensors that view the mapping without copying.
+
+    The mapping is private copy-on-write: pages are read from the page cache on
+    first touch and shared with other processes mapping the same file until written.
+    """
+    import torch
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_size
+    state = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            state[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        state[name] = torch.frombuffer(mapping, dtype=dtype, count=count, offset=base + start).view(info["shape"])
+    return state
+
+
+def _mapped_module(library: str, class_name: str, directory: Path, dtype: "torch.dtype") -> Optional[Any]:
+    """Build one pipeline component on the meta device and assign it mmapped weights.
+
+    Returns None when the component cannot be mapped as stored (no single safetensors
+    file, weights in another dtype, or keys that do not cover the module), so the
+    caller lets from_pretrained load it instead.
+    """
+    from accelerate import init_empty_weights
+
+    weights = directory / WEIGHT_FILES[library]
+    if not weights.exists() or not (directory / "config.json").exists():
+        return None
+    state = load_mmap_state_dict(weights)
+    if any(t.is_floating_point() and t.dtype != dtype for t in state.values()):
+        return None
+
+    cls = getattr(importlib.import_module(library), class_name)
+    with init_empty_weights():
+        if library == "diffusers":
+            model = cls.from_config(cls.load_config(directory))
+        else:
+            model = cls(cls.config_class.from_pretrained(directory))
+    model.load_state_dict(state, strict=False, assign=True)
+    if hasattr(model, "tie_weights"):
+        model.tie_weights()
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        return None
+    return model.eval()
+
+
+def load_mapped_pipeline(pipeline_class: Any, path: Path, dtype: "torch.dtype",
+                         components: Optional[Dict[str, Any]] = None) -> Tuple[Any, int]:
+    """Load a pipeline saved on local disk, mapping each component's safetensors weights zero-copy.
+
+    Components passed in are used as they are; the others that cannot be mapped
+    load through from_pretrained. Returns the pipeline and how many components were mapped.
+    """
+    components = components or {}
+    index = json.loads((Path(path) / "model_index.json").read_text())
+    modules = {}
+    for name, value in index.items():
+        if name in components or not isinstance(value, list) or value[0] not in WEIGHT_FILES:
+            continue
+        try:
+            module = _mapped_module(value[0], value[1], Path(path) / name, dtype)
+        except Exception as e:
+            print(f"Could not map {name} weights, loading them normally: {e}")
+            module = None
+        if module is not None:
+            modules[name] = module
+    return pipeline_class.from_pretrained(str(path), torch_dtype=dtype, **modules, **components), len(modules)
+
+
+def local_snapshot(model_id: str) -> Optional[Path]:
+    """Return a local directory holding the model, if it is a path or already in the Hugging Face cache."""
+    if os.path.isdir(model_id):
+        return Path(model_id)
+    try:
+        from huggingface_hub import snapshot_download
+        return Path(snapshot_download(model_id, local_files_only=True))
+    except Exception:
+        return None
+
+
+def cache_path(cache_dir: Path, model_id: str, dtype: "torch.dtype") -> Path:
+    """Directory of a model's converted weights for one dtype."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "--", model_id.strip("/"))
+    return Path(cache_dir) / f"{slug}--{str(dtype).replace('torch.', '')}"
+
+
+def save_converted(pipe: Any, target: Path, model_id: str, dtype: "torch.dtype") -> None:
+    """Save a loaded pipeline's weights as safetensors, moving the copy into place atomically."""
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        pipe.save_pretrained(str(tmp), safe_serialization=True)
+        (tmp / "weight_cache.json").write_text(json.dumps({
+            "model_id": model_id,
+            "dtype": str(dtype),
+            "created_at": time.time(),
+        }))
+        os.replace(tmp, target)
+    except OSError as e:
+        # Another process may have finished the same conversion first
+        if not (target / "model_index.json").exists():
+            print(f"Could not write converted weights to {target}: {e}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_pipeline(pipeline_class: Any, model_id: str, dtype: "torch.dtype",
+                  cache_dir: Optional[str] = None, components: Optional[Dict[str, Any]] = None) -> Any:
+    """Load a pipeline with the least copying available, and record how the load went on it.
+
+    Weights come from, in order: the converted-weight cache in cache_dir, already in
+    the target dtype and mapped zero-copy; the model's local files, mapped when
+    stored in the target dtype; from_pretrained, which prefers safetensors. With
+    cache_dir set, any other load is saved there for next time. Modules in
+    components (e.g. another model's VAE) are used instead of loading their own.
+    pipe.load_info reports the source, seconds and peak memory of the load.
+    """
+    cached = cache_path(Path(cache_dir), model_id, dtype) if cache_dir else None
+    local = local_snapshot(model_id)
+    start = time.perf_counter()
+    with rss_tracker.track() as rss:
+        pipe, mapped = None, 0
+        if cached is not None and (cached / "model_index.json").exists():
+            pipe, mapped = load_mapped_pipeline(pipeline_class, cached, dtype, components)
+            source = "weight_cache"
+        elif local is not None and (local / "model_index.json").exists():
+            pipe, mapped = load_mapped_pipeline(pipeline_class, local, dtype, components)
+            source = "local"
+        if pipe is None:
+            pipe = pipeline_class.from_pretrained(model_id, torch_dtype=dtype, **(components or {}))
+            source = "hub"
+    seconds = time.perf_counter() - start
+
+    if cached is not None and source != "weight_cache":
+        save_converted(pipe, cached, model_id, dtype)
+
+    pipe.load_info = {
+        "source": source,
+        "mapped_components": mapped,
+        "seconds": round(seconds, 3),
+        "peak_rss_bytes": rss["peak"],
+    }
+    LOAD_PEAK_RSS.set(rss["peak"], model=model_id, source=source)
+    return pipe
+
+
+def weight_cache_dir() -> Optional[str]:
+    """Read the converted-weight cache location from SD_WEIGHT_CACHE_DIR (unset disables it)."""
+    return os.environ.get("SD_WEIGHT_CACHE_DIR") or None
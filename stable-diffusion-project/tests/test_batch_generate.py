@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from batch_generate import read_jobs
+
+
+def write_jobs(tmp_path, rows):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    return str(path)
+
+
+def test_identical_rows_get_distinct_stable_ids(tmp_path):
+    path = write_jobs(tmp_path, [{"prompt": "a cat"}, {"prompt": "a cat"}, {"prompt": "a dog"}])
+    ids = [job["id"] for job in read_jobs(path)]
+    assert len(set(ids)) == 3
+    assert ids == [job["id"] for job in read_jobs(path)]
+
+
+def test_repeated_explicit_id_is_refused(tmp_path):
+    path = write_jobs(tmp_path, [{"prompt": "a cat", "id": "x"}, {"prompt": "a dog", "id": "x"}])
+    with pytest.raises(ValueError):
+        list(read_jobs(path))
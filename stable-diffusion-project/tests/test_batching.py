@@ -0,0 +1,91 @@
+from dataclasses import replace
+from types import SimpleNamespace
+
+import pytest
+
+import batching
+from batching import BatchRequest, MicroBatcher, run_text2img_batch
+from config.model_config import GenerationSpec
+from progress import GenerationCancelled
+
+SPEC = GenerationSpec(model_id="m", device="cpu", num_inference_steps=2, guidance_scale=7.5, width=64,
+                      height=64, seed=None, scheduler="default", negative_prompt="", num_images=1)
+
+
+def echo_batches(batches):
+    """A run_batch that records each batch and returns every request's prompt per seed."""
+    def run_batch(requests):
+        batches.append([req.prompt for req in requests])
+        return [[f"{req.prompt}:{seed}" for seed in req.seeds] for req in requests]
+    return run_batch
+
+
+def submit_together(batcher, *requests):
+    """Submit requests while the batcher is held, so they are all pending at once."""
+    with batcher._cond:
+        futures = [batcher.submit(spec, prompt, seeds) for spec, prompt, seeds in requests]
+    return [future.result(5) for future in futures]
+
+
+def test_compatible_requests_share_a_batch_and_get_their_own_images():
+    batches = []
+    batcher = MicroBatcher(max_batch_size=4, max_wait=0.5, run_batch=echo_batches(batches))
+    results = submit_together(batcher, (SPEC, "a", [1, 2]), (SPEC, "b", [3]))
+    assert results == [["a:1", "a:2"], ["b:3"]]
+    assert batches == [["a", "b"]]
+
+
+def test_incompatible_requests_run_separately():
+    batches = []
+    batcher = MicroBatcher(max_batch_size=4, max_wait=0.01, run_batch=echo_batches(batches))
+    submit_together(batcher, (SPEC, "a", [1]), (replace(SPEC, width=128), "b", [2]))
+    assert sorted(batches) == [["a"], ["b"]]
+
+
+def test_batches_stop_at_max_batch_size():
+    batches = []
+    batcher = MicroBatcher(max_batch_size=2, max_wait=0.01, run_batch=echo_batches(batches))
+    submit_together(batcher, (SPEC, "a", [1]), (SPEC, "b", [2]), (SPEC, "c", [3]))
+    assert batches == [["a", "b"], ["c"]]
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Replace the pipeline call with one that steps once and returns one image name per row."""
+    calls = []
+
+    def call_pipeline(pipe, config, generator, callback_on_step_end, **kwargs):
+        calls.append(generator)
+        latents = [f"latent{i}" for i in range(len(generator))]
+        callback_on_step_end(pipe, 0, 999, {"latents": latents})
+        return SimpleNamespace(images=[f"image{i}" for i in range(len(generator))])
+
+    monkeypatch.setattr(batching, "get_pipeline", lambda config: None)
+    monkeypatch.setattr(batching, "make_generators", list)
+    monkeypatch.setattr(batching, "call_pipeline", call_pipeline)
+    monkeypatch.setattr(batching.prompt_cache, "embeddings", lambda *args: {})
+    return calls
+
+
+def test_batch_rows_are_split_back_per_request(fake_pipeline):
+    seen = {}
+
+    def record(name):
+        def callback(pipe, step, timestep, kwargs):
+            seen[name] = kwargs["latents"]
+        return callback
+
+    requests = [BatchRequest(SPEC, "a", [1, 2], record("a")), BatchRequest(SPEC, "b", [3], record("b"))]
+    assert run_text2img_batch(requests) == [["image0", "image1"], ["image2"]]
+    assert fake_pipeline == [[1, 2, 3]]
+    assert seen == {"a": ["latent0", "latent1"], "b": ["latent2"]}
+
+
+def test_cancelling_one_request_fails_only_that_request(fake_pipeline):
+    def cancel(pipe, step, timestep, kwargs):
+        raise GenerationCancelled("stop")
+
+    requests = [BatchRequest(SPEC, "a", [1], cancel), BatchRequest(SPEC, "b", [2])]
+    results = run_text2img_batch(requests)
+    assert isinstance(requests[0].future.exception(0), GenerationCancelled)
+    assert results[1] == ["image1"]
@@ -0,0 +1,50 @@
+import os
+import time
+
+from PIL import Image
+
+from image_writer import ImageWriter
+from output_store import OutputStore
+
+
+def make_store(tmp_path):
+    return OutputStore(str(tmp_path), ImageWriter(num_threads=2))
+
+
+def age(store, record, seconds):
+    """Backdate a record's sidecar, which the sweeper reads its age from."""
+    sidecar = store._sidecar(record["id"])
+    stamp = time.time() - seconds
+    os.utime(sidecar, (stamp, stamp))
+
+
+def test_keyed_record_is_found_from_another_store_on_the_same_root(tmp_path):
+    record = make_store(tmp_path).save([Image.new("RGB", (8, 8))], {}, [1], key="ab" * 32)
+    assert make_store(tmp_path).get("ab" * 32)["id"] == record["id"]
+    assert make_store(tmp_path).get("cd" * 32) is None
+
+
+def test_sweep_deletes_records_past_max_age(tmp_path):
+    store = make_store(tmp_path)
+    old = store.save([Image.new("RGB", (8, 8))], {}, [1], key="ab" * 32)
+    new = store.save_file(b"x" * 100, "png", {})
+    age(store, old, 3600)
+    assert store.sweep(max_age=60) == 1
+    assert store.get("ab" * 32) is None
+    assert all(not (tmp_path / name).exists() for name in old["files"])
+    assert (tmp_path / new["files"][0]).exists()
+
+
+def test_sweep_deletes_oldest_records_beyond_max_bytes(tmp_path):
+    store = make_store(tmp_path)
+    records = [store.save_file(b"x" * 1000, "png", {}) for _ in range(3)]
+    for i, record in enumerate(records):
+        age(store, record, 300 - i * 100)
+    assert store.sweep(max_bytes=2500) == 1
+    assert [(tmp_path / r["files"][0]).exists() for r in records] == [False, True, True]
+
+
+def test_only_one_store_on_a_root_holds_the_sweeper_lock(tmp_path):
+    first, second = make_store(tmp_path), make_store(tmp_path)
+    assert first._hold_sweeper_lock()
+    assert not second._hold_sweeper_lock()
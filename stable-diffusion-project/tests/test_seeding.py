@@ -0,0 +1,25 @@
+import pytest
+
+from seeding import make_generators, resolve_seeds
+
+
+def test_pinned_seed_gives_consecutive_seeds():
+    assert resolve_seeds(42, 3) == [42, 43, 44]
+
+
+def test_float_seed_is_cast_to_int():
+    seeds = resolve_seeds(42.0, 2)
+    assert seeds == [42, 43]
+    assert all(type(seed) is int for seed in seeds)
+
+
+def test_random_seeds_are_independent_ints():
+    seeds = resolve_seeds(None, 4)
+    assert len(seeds) == 4
+    assert all(isinstance(seed, int) and 0 <= seed < 2**32 for seed in seeds)
+
+
+def test_make_generators_accepts_float_seeds():
+    torch = pytest.importorskip("torch")
+    a, b = make_generators([7.0, 7])
+    assert torch.equal(torch.rand(4, generator=a), torch.rand(4, generator=b))
@@ -0,0 +1,31 @@
+from startup import Prewarmer
+
+
+def make_prewarmer(*states):
+    prewarmer = Prewarmer({f"m{i}": None for i in range(len(states))})
+    for i, state in enumerate(states):
+        prewarmer._set(f"m{i}", state=state)
+    return prewarmer
+
+
+def test_not_ready_while_a_model_is_loading():
+    assert not make_prewarmer("warm", "loading").status()["ready"]
+
+
+def test_ready_when_every_model_is_warm():
+    status = make_prewarmer("warm", "warm").status()
+    assert status["ready"] and not status["degraded"]
+
+
+def test_ready_but_degraded_when_some_models_failed():
+    status = make_prewarmer("warm", "failed").status()
+    assert status["ready"] and status["degraded"]
+
+
+def test_not_ready_when_every_model_failed():
+    status = make_prewarmer("failed", "failed").status()
+    assert not status["ready"] and status["degraded"]
+
+
+def test_ready_with_nothing_to_prewarm():
+    assert Prewarmer({}).status()["ready"]